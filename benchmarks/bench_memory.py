@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the memory held by each `Package` after computing download
+statistics. Requires Python >= 3.4.
+
+Usage: python benchmarks/bench_memory.py [N_RELEASES] [N_PACKAGES]
+"""
+import os
+import sys
+import json
+import random
+import tracemalloc
+
+# Import pypi_cli from this checkout when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+import pypi_cli as pypi  # noqa: E402
+
+
+def make_document(n, name='package', seed=0):
+    """Return a synthetic JSON document (bytes) for a package with ``n``
+    releases of two files each.
+    """
+    rand = random.Random(seed)
+    releases = {}
+    for i in range(n):
+        version = '{0}.{1}.{2}'.format(i // 100, i // 10 % 10, i % 10)
+        upload_time = '20{0:02}-{1:02}-{2:02}T12:00:00'.format(
+            10 + i // 360 % 90, i // 30 % 12 + 1, i % 28 + 1)
+        releases[version] = [{
+            'filename': 'package-{0}.{1}'.format(version, ext),
+            'packagetype': packagetype,
+            'python_version': 'source',
+            'url': 'https://files.example.com/package-{0}.{1}'.format(
+                version, ext),
+            'md5_digest': '%032x' % rand.getrandbits(128),
+            'size': rand.randint(1000, 100000),
+            'comment_text': '',
+            'has_sig': False,
+            'upload_time': upload_time,
+            'downloads': rand.randint(0, 100000),
+        } for packagetype, ext in (('sdist', 'tar.gz'),
+                                   ('bdist_wheel', 'whl'))]
+    info = {'name': name, 'version': version, 'summary': 'A package',
+            'author': 'Someone', 'author_email': 'someone@example.com',
+            'maintainer': None, 'maintainer_email': None, 'license': 'MIT',
+            'home_page': 'https://example.com/' + name,
+            'package_url': 'https://pypi.org/project/' + name,
+            'release_url': 'https://pypi.org/project/{0}/{1}'.format(
+                name, version),
+            'docs_url': None, 'bugtrack_url': None,
+            'classifiers': ['Programming Language :: Python :: 3'],
+            'description': 'A description. ' * 200,
+            'downloads': {'last_day': 1, 'last_week': 7, 'last_month': 30}}
+    return json.dumps({'info': info, 'releases': releases}).encode('utf-8')
+
+
+def measure(body, n_packages, fields=None, compact=False):
+    """Return the memory held per package, in bytes."""
+    tracemalloc.start()
+    packages = []
+    for i in range(n_packages):
+        package = pypi.Package('package')
+        package.fields = fields
+        package.fetch = lambda: body
+        package.downloads
+        package.version_downloads
+        if compact:
+            package.compact()
+        packages.append(package)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / n_packages
+
+
+def main(n=500, n_packages=20):
+    body = make_document(n)
+    print('{0} packages with {1:,} releases each'.format(n_packages, n))
+    for label, fields, compact in (
+            ('full document', None, False),
+            ('stat fields', ('info', 'releases'), False),
+            ('compact', ('info', 'releases'), True)):
+        size = measure(body, n_packages, fields, compact)
+        print('{0:>14}: {1:,.1f} KiB per package'.format(label, size / 1024))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
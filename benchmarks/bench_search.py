@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Benchmark ranking of search results.
+
+Usage: python benchmarks/bench_search.py [N_RECORDS]
+"""
+import os
+import sys
+import random
+import timeit
+
+# Import pypi_cli from this checkout when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+import pypi_cli as pypi  # noqa: E402
+
+WORDS = ('django', 'flask', 'rest', 'api', 'auth', 'oauth', 'test', 'utils',
+         'async', 'client', 'tools', 'extension', 'framework', 'cache')
+
+
+def make_results(n, seed=0):
+    """Return ``n`` synthetic XML-RPC search results, about 10% of which
+    are duplicates.
+    """
+    rand = random.Random(seed)
+    results = []
+    for i in range(n):
+        if results and rand.random() < 0.1:
+            results.append(rand.choice(results))
+            continue
+        name = '-'.join(rand.sample(WORDS, 2) + [str(i)])
+        summary = ' '.join(rand.choice(WORDS) for _ in range(12))
+        results.append({'name': name, 'summary': summary,
+                        'version': '1.0', '_pypi_ordering': 0})
+    return results
+
+
+def main(n=50000):
+    results = make_results(n)
+    searcher = pypi.Searcher(client=object())
+    tokens = searcher.tokenize('django rest')
+    for limit in (pypi.DEFAULT_SEARCH_RESULTS, None):
+        timer = timeit.Timer(lambda: searcher.rank(tokens, results, n=limit))
+        best = min(timer.repeat(repeat=3, number=1))
+        print('rank {0:,} records, n={1}: {2:.1f} ms'.format(
+            n, limit, best * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
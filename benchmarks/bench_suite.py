@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Benchmark `Package`, `Searcher` and the ``stat``, ``info`` and ``search``
+commands against large synthetic responses, served with ``responses``.
+
+Results are saved to ``benchmarks/results/<commit>.json`` so that they can be
+compared across commits.
+
+Usage: python benchmarks/bench_suite.py [--releases N] [--hits N]
+                                        [--compare COMMIT] [--no-save]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import timeit
+
+import responses
+from click.testing import CliRunner
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+# Import pypi_cli from this checkout when run as a script
+sys.path.insert(0, os.path.dirname(HERE))
+
+import pypi_cli as pypi  # noqa: E402
+from bench_memory import make_document  # noqa: E402
+from bench_search import make_results  # noqa: E402
+
+RESULTS_DIR = os.path.join(HERE, 'results')
+PACKAGE_URL = '{0}/big/json'.format(pypi.DEFAULT_PYPI)
+QUERY = 'django rest'
+
+
+def search_response(n):
+    """Return an XML-RPC response body with ``n`` search results."""
+    from xmlrpc.client import dumps
+    return dumps((make_results(n),), methodresponse=True)
+
+
+def loaded_package(data):
+    package = pypi.Package('big')
+    package._lazy_data = data
+    return package
+
+
+def make_benchmarks(data):
+    """Return (name, function) pairs. HTTP requests must be mocked."""
+    runner = CliRunner(env={'PYPI_CLI_NO_CACHE': '1'})
+
+    def invoke(*args):
+        result = runner.invoke(pypi.cli, args)
+        assert result.exit_code == 0, result.output
+
+    def stats():
+        package = loaded_package(data)
+        return (package.downloads, package.max_version, package.min_version,
+                package.average_downloads)
+
+    return [
+        ('package.data', lambda: pypi.Package('big').data),
+        ('package.releases', lambda: loaded_package(data).releases),
+        ('package.stats', stats),
+        ('package.version_downloads',
+         lambda: loaded_package(data).version_downloads),
+        ('package.chart', lambda: loaded_package(data).chart()),
+        ('package.chart(group_by=minor)',
+         lambda: loaded_package(data).chart(group_by='minor')),
+        ('package.chart(max_bars=50)',
+         lambda: loaded_package(data).chart(max_bars=50)),
+        ('searcher.search', lambda: list(pypi.Searcher().search(QUERY))),
+        ('cli stat', lambda: invoke('stat', 'big')),
+        ('cli stat --format json',
+         lambda: invoke('stat', '-f', 'json', 'big')),
+        ('cli info', lambda: invoke('info', 'big')),
+        ('cli compare', lambda: invoke('compare', 'big', 'big')),
+        ('cli search', lambda: invoke('search', QUERY)),
+    ]
+
+
+def run(n_releases, n_hits, repeat=5):
+    """Return a dictionary of benchmark name: best time in seconds."""
+    body = make_document(n_releases, name='big')
+    data = pypi.load_package_data(body)
+    results = {}
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as mock:
+        mock.add(responses.GET, PACKAGE_URL, body=body,
+                 content_type='application/json')
+        mock.add(responses.POST, pypi.DEFAULT_PYPI,
+                 body=search_response(n_hits), content_type='text/xml')
+        for name, func in make_benchmarks(data):
+            timer = timeit.Timer(func)
+            results[name] = min(timer.repeat(repeat=repeat, number=1))
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def load(commit):
+    with open(os.path.join(RESULTS_DIR, commit + '.json')) as fp:
+        return json.load(fp)['results']
+
+
+def save(commit, results, params):
+    if not os.path.isdir(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    path = os.path.join(RESULTS_DIR, commit + '.json')
+    with open(path, 'w') as fp:
+        json.dump({'commit': commit, 'time': time.time(),
+                   'python': sys.version.split()[0], 'params': params,
+                   'results': results}, fp, indent=2, sort_keys=True)
+    return path
+
+
+def report(results, baseline=None):
+    width = max(len(name) for name in results)
+    for name, seconds in results.items():
+        line = '{0:{1}}  {2:10.2f} ms'.format(name, width, seconds * 1000)
+        if baseline and name in baseline:
+            line += '  {0:6.2f}x'.format(seconds / baseline[name])
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--releases', type=int, default=5000,
+                        help='Number of releases of the package.')
+    parser.add_argument('--hits', type=int, default=50000,
+                        help='Number of search results.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--compare', metavar='COMMIT',
+                        help='Show times relative to a saved commit.')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args(argv)
+    baseline = load(args.compare) if args.compare else None
+    print('{0:,} releases, {1:,} search results'.format(args.releases,
+                                                        args.hits))
+    results = run(args.releases, args.hits, repeat=args.repeat)
+    report(results, baseline)
+    if not args.no_save:
+        path = save(current_commit(), results,
+                    {'releases': args.releases, 'hits': args.hits})
+        print('Saved to {0}'.format(os.path.relpath(path)))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,22 +10,28 @@
     :license: MIT, see LICENSE for more details.
 """
 from __future__ import division, print_function
+import io
+import os
 import re
 import sys
+import json
 import time
+import heapq
 import textwrap
 import math
-from collections import OrderedDict
+import calendar
+import threading
+from array import array
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
 PY2 = int(sys.version[0]) == 2
 if PY2:
-    from xmlrpclib import ServerProxy
     from urllib import quote as urlquote
 else:
-    from xmlrpc.client import ServerProxy
     from urllib.parse import quote as urlquote
 
-import requests
-from dateutil.parser import parse as dateparse
+# NOTE: requests, xmlrpc and dateutil are imported where they are used to
+# keep startup fast. Run `invoke startup` to check the import time.
 import click
 from click import echo, secho, style, echo_via_pager
 from click.termui import get_terminal_size
@@ -37,6 +43,17 @@ __license__ = 'MIT'
 DATE_FORMAT = "%y/%m/%d"
 MARGIN = 3
 DEFAULT_SEARCH_RESULTS = 100
+# Ways to group releases. See Package.group_releases.
+GROUP_BY = ('major', 'minor', 'month', 'quarter')
+# Columns that `pypi compare` can sort by
+COMPARE_SORT_FIELDS = ('releases', 'downloads', 'median', 'per_day',
+                       'interval_days')
+# Fields of XML-RPC release data added to search results by Searcher.enrich
+RELEASE_DATA_FIELDS = ('author', 'home_page', 'license', 'requires_python')
+# Output formats. All but 'text' emit one record per package or result.
+FORMATS = ('text', 'json', 'jsonl', 'csv')
+# Number of packages to fetch concurrently in multi-package commands
+DEFAULT_JOBS = 8
 
 TICK = '*'
 DEFAULT_PYPI = 'https://pypi.python.org/pypi'
@@ -44,16 +61,108 @@ PYPI_RE = re.compile('''^(?:(?P<pypi>https?://[^/]+/pypi)/)?
                         (?P<name>[-A-Za-z0-9_.]+)
                         (?:/(?P<version>[-A-Za-z0-9.]+))?$''', re.X)
 SEARCH_URL = 'https://pypi.python.org/pypi?%3Aaction=search&term={query}'
-
-# Number of characters added by bold formatting
-_BOLD_LEN = 8
-# Number of characters added by color formatting
-_COLOR_LEN = 9
+# Upload times as emitted by PyPI, e.g. 2014-06-05T00:39:25 (optionally
+# followed by fractional seconds)
+UPLOAD_TIME_RE = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)'
+                            r'(?:\.(\d{1,6}))?$')
+
+# The project name of a requirement specifier, e.g. "Flask[async]>=2.0"
+REQUIREMENT_RE = re.compile(r'^(?P<name>[A-Za-z0-9](?:[-A-Za-z0-9_.]*'
+                            r'[A-Za-z0-9])?)\s*(?:$|[\[(;<>=!~@ ])')
+
+# A Requires-Dist entry, e.g. "requests[socks] (>=2.0) ; extra == 'http'"
+REQUIRES_DIST_RE = re.compile(r'''^\s*(?P<name>[A-Za-z0-9](?:[-A-Za-z0-9_.]*
+                                  [A-Za-z0-9])?)\s*
+                              (?:\[(?P<extras>[^\]]*)\])?\s*
+                              \(?(?P<specifier>[^;()]*?)\)?\s*
+                              (?:;\s*(?P<marker>.*?))?\s*$''', re.X)
+# Extras referenced by an environment marker, e.g. extra == "socks"
+MARKER_EXTRA_RE = re.compile(r'''\bextra\s*==\s*['"]([^'"]*)['"]''')
+# Environment marker values for `deps --platform`
+PLATFORMS = {
+    'linux': {'sys_platform': 'linux', 'platform_system': 'Linux',
+              'os_name': 'posix'},
+    'darwin': {'sys_platform': 'darwin', 'platform_system': 'Darwin',
+               'os_name': 'posix'},
+    'win32': {'sys_platform': 'win32', 'platform_system': 'Windows',
+              'os_name': 'nt'},
+}
+
+# The epoch, major and minor version numbers of a PEP 440 version
+VERSION_RE = re.compile(r'^\s*v?(?:\d+!)?(?P<major>\d+)(?:\.(?P<minor>\d+))?',
+                        re.I)
+
+# Keys of release file entries that are kept when parsing only some fields
+# of a package's JSON document
+RELEASE_FILE_FIELDS = ('upload_time', 'downloads')
+
+# Responses cache defaults: 50 MB, entries unused for 30 days are evicted
+DEFAULT_CACHE_SIZE = 50 * 1024 * 1024
+DEFAULT_CACHE_AGE = 30 * 24 * 60 * 60
+
+# HTTP defaults: timeout in seconds, connections kept alive per host
+DEFAULT_TIMEOUT = 10
+DEFAULT_POOL_SIZE = DEFAULT_JOBS
+# `pypi serve` defaults: seconds before packages and search results are
+# refetched, number of packages kept in memory, and the file in the cache
+# directory that tells clients where the daemon is listening
+DEFAULT_SERVE_TTL = 300
+DEFAULT_SERVE_PACKAGES = 256
+DAEMON_STATE_FILE = 'serve.json'
+# Seconds to wait for the daemon before falling back to contacting PyPI
+DAEMON_TIMEOUT = 2
+
+# Retry failed requests with exponential backoff starting at 0.5 seconds
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 60
+RETRY_STATUSES = (429, 500, 502, 503, 504)
 
 
 @click.group(context_settings={'help_option_names': ('-h', '--help')})
 @click.version_option(__version__, '--version', '-v', message='%(version)s')
-def cli():
+@click.option('--cache-dir', envvar='PYPI_CLI_CACHE_DIR', default=None,
+              type=click.Path(file_okay=False),
+              help='Directory for cached data. Defaults to ~/.cache/pypi-cli.')
+@click.option('--no-cache', is_flag=True, default=False,
+              envvar='PYPI_CLI_NO_CACHE', help="Don't cache responses.")
+@click.option('--max-age', envvar='PYPI_CLI_MAX_AGE', default=None,
+              type=click.IntRange(0), metavar='SECONDS',
+              help='Use cached responses up to this old without '
+                   'contacting PyPI.')
+@click.option('--offline', is_flag=True, default=False,
+              envvar='PYPI_CLI_OFFLINE',
+              help='Only use cached responses. Never contact PyPI.')
+@click.option('--timeout', envvar='PYPI_CLI_TIMEOUT', default=DEFAULT_TIMEOUT,
+              type=click.FloatRange(0), metavar='SECONDS',
+              help='Timeout for requests to PyPI.')
+@click.option('--pool-size', envvar='PYPI_CLI_POOL_SIZE',
+              default=DEFAULT_POOL_SIZE, type=click.IntRange(1),
+              help='Number of connections to PyPI to keep alive. Raised to '
+                   '--jobs if lower.')
+@click.option('--retries', envvar='PYPI_CLI_RETRIES', default=DEFAULT_RETRIES,
+              type=click.IntRange(0),
+              help='Number of times to retry failed requests.')
+@click.option('--rate', envvar='PYPI_CLI_RATE', default=None,
+              type=click.FloatRange(0), metavar='N',
+              help='Maximum number of requests per second.')
+@click.option('--profile', 'trace', is_flag=True, default=False,
+              envvar='PYPI_CLI_TRACE',
+              help='Print the time spent in each phase (requests, parsing, '
+                   'rendering) to stderr on exit.')
+@click.option('--profile-output', 'trace_output', default=None,
+              envvar='PYPI_CLI_TRACE_OUTPUT', type=click.Path(dir_okay=False),
+              help='Write the timings as JSON to this file instead.')
+@click.option('--cprofile', default=None, envvar='PYPI_CLI_CPROFILE',
+              type=click.Path(dir_okay=False), metavar='PATH',
+              help='Run the command with cProfile and write its stats to '
+                   'this file.')
+@click.option('--no-daemon', is_flag=True, default=False,
+              envvar='PYPI_CLI_NO_DAEMON',
+              help="Don't use a running \"pypi serve\" daemon.")
+@click.pass_context
+def cli(ctx, cache_dir, no_cache, max_age, offline, timeout, pool_size,
+        retries, rate, trace, trace_output, cprofile, no_daemon):
     """The pypi CLI.
 
     \b
@@ -67,7 +176,50 @@ def cli():
     \b
         pypi stat --help
     """
-    pass
+    if offline and no_cache:
+        raise click.UsageError('--offline cannot be used with --no-cache.')
+    scheduler = Scheduler(max_per_host=pool_size, rate=rate, retries=retries)
+    if trace or trace_output or cprofile:
+        profiler = Profiler(cprofile=bool(cprofile)).start()
+        ctx.call_on_close(lambda: finish_profile(
+            profiler, scheduler, trace or trace_output, trace_output,
+            cprofile))
+    cache_dir = cache_dir or default_cache_dir()
+    cache = None
+    if not no_cache:
+        cache = ResponseCache(os.path.join(cache_dir, 'responses'))
+        cache.prune()
+    transport = Transport(pool_size=pool_size, timeout=timeout,
+                          scheduler=scheduler)
+    options = {'cache': cache, 'max_age': max_age, 'offline': offline}
+    # The daemon may contact PyPI, so it isn't used offline. It is also a
+    # cache, so it isn't used with --no-cache
+    if not (no_daemon or offline or no_cache or
+            ctx.invoked_subcommand == 'serve'):
+        options['daemon'] = DaemonClient.discover(cache_dir)
+    mirror = get_mirror(cache_dir)
+    ctx.obj = {
+        'cache_dir': cache_dir,
+        'transport': transport,
+        # Keyword arguments for Searcher
+        'search_options': dict(options, transport=transport),
+        # Keyword arguments for Package
+        'package_options': dict(options, client=transport,
+                                mirror=mirror if mirror.exists() else None),
+    }
+
+
+def finish_profile(profiler, scheduler, trace, trace_output, cprofile):
+    """Stop ``profiler`` and print or write its results."""
+    profiler.stop()
+    if cprofile:
+        profiler.cprofile.dump_stats(cprofile)
+    if trace_output:
+        with io.open(trace_output, 'w', encoding='utf-8') as fp:
+            fp.write(u'{0}\n'.format(json.dumps(
+                profiler.summary(scheduler.stats), indent=2)))
+    elif trace:
+        echo(profiler.report(scheduler.stats), err=True)
 
 
 def abort_not_found(name):
@@ -81,47 +233,182 @@ def echo_header(text):
     secho('=' * len(text), bold=True)
 
 
-def get_package(name_or_url, client=None):
+def get_package(name_or_url, client=None, **kwargs):
     m = PYPI_RE.match(name_or_url)
     if not m:
         return None
     pypi_url = m.group('pypi') or DEFAULT_PYPI
     name = m.group('name')
-    return Package(name, pypi_url=pypi_url, client=client)
+    return Package(name, pypi_url=pypi_url, client=client, **kwargs)
+
+
+def imap(func, iterable, jobs=DEFAULT_JOBS):
+    """Like `map`, but calls ``func`` from up to ``jobs`` threads. Items
+    are consumed and results are yielded lazily, in order.
+    """
+    if jobs > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(jobs)
+        try:
+            for result in pool.imap(func, iterable):
+                yield result
+        finally:
+            pool.terminate()
+    else:
+        for item in iterable:
+            yield func(item)
+
+
+def _prefetch(package):
+    """Fetch a package's data, returning the error raised, if any."""
+    if package is None:
+        return None
+    try:
+        package.data
+    except PackageError as error:
+        return error
+    return None
+
+
+def _fetch(package):
+    """Return a package's raw JSON document or the error raised."""
+    try:
+        return package.fetch()
+    except PackageError as error:
+        return error
+
+
+def iter_packages(names, client=None, jobs=DEFAULT_JOBS, **kwargs):
+    """Yield ``(name_or_url, package, error)`` tuples in the order given,
+    fetching up to ``jobs`` packages' data concurrently. ``names`` may be
+    any iterable, and is consumed as packages are fetched.
+
+    ``package`` is `None` if ``name_or_url`` is invalid. ``error`` is the
+    `PackageError` raised while fetching the package's data, if any.
+    Additional keyword arguments are passed to the `Package` constructor.
+    """
+    def load(name):
+        package = get_package(name, client, **kwargs)
+        return name, package, _prefetch(package)
+    return imap(load, names, jobs)
+
+
+def iter_names(packages, requirements=()):
+    """Yield package names or URLs from command line arguments, followed
+    by the names in requirements files. The argument ``-`` reads a
+    requirements file from stdin.
+    """
+    for name_or_url in packages:
+        if name_or_url == '-':
+            for name in parse_requirements(click.get_text_stream('stdin')):
+                yield name
+        else:
+            yield name_or_url
+    for fp in requirements:
+        for name in parse_requirements(fp):
+            yield name
+
+
+def get_writer(output_format, fields):
+    """Return a `RecordWriter` that writes to stdout or `None` if the
+    output format is 'text'.
+    """
+    if output_format == 'text':
+        return None
+    return RecordWriter(output_format, fields, _Stdout())
+
+
+class _Stdout(object):
+    """File-like object that writes using `click.echo`."""
+
+    def write(self, text):
+        echo(text, nl=False)
+
+
+def echo_invalid(name_or_url):
+    secho(u'Invalid name or URL: "{name}"'.format(name=name_or_url),
+          fg='red', file=sys.stderr)
+
+
+def echo_skipping(package, error):
+    if isinstance(error, NotFoundError):
+        message = u'No versions found for "{0}".'.format(package.name)
+    else:
+        message = u'Could not get "{0}": {1}.'.format(package.name, error)
+    secho(message + u' Skipping. . .', fg='red', file=sys.stderr)
 
 
 @cli.command()
 @click.option('--graph/--no-graph', '-g/-q', default=True,
               help="Output a graph of download counts.")
-@click.argument('package', nargs=-1, required=True)
-def stat(package, graph):
-    """Print download statistics for a package.
+@click.option('--group-by', type=click.Choice(GROUP_BY), default=None,
+              help='Group downloads by major or minor version, or by the '
+                   'month or quarter of release.')
+@click.option('--top', type=click.IntRange(1), default=None, metavar='N',
+              help='Only show the N versions or groups with the most '
+                   'downloads, and combine the rest.')
+@click.option('--max-bars', type=click.IntRange(1), default=None,
+              help='Combine consecutive versions so that the graph has at '
+                   'most this many bars.')
+@click.option('--jobs', '-j', default=DEFAULT_JOBS, type=click.IntRange(1),
+              help='Number of packages to fetch concurrently.')
+@click.option('--from-file', '--requirement', '-r', 'requirements',
+              multiple=True, type=click.File(),
+              help='Read package names from a requirements file.')
+@click.option('--format', '-f', 'output_format', type=click.Choice(FORMATS),
+              default='text', help='Output format.')
+@click.argument('package', nargs=-1)
+@click.pass_obj
+def stat(obj, package, graph, group_by, top, max_bars, jobs, requirements,
+         output_format):
+    """Print download statistics for a package or packages.
 
     \b
-    Example:
-
+    Examples:
+        \b
         pypi stat requests
+        pypi stat -r requirements.txt
+        pip freeze | pypi stat -
+        pypi stat --format jsonl -r requirements.txt
+        pypi stat --group-by minor --top 5 Django
     """
-    client = requests.Session()
-    for name_or_url in package:
-        package = get_package(name_or_url, client)
+    if not package and not requirements:
+        raise click.UsageError('Missing argument "package".')
+    names = iter_names(package, requirements)
+    obj['transport'].allow_concurrency(jobs)
+    packages = iter_packages(names, jobs=jobs,
+                             fields=('info', 'releases'),
+                             **obj['package_options'])
+    writer = get_writer(output_format, STAT_FIELDS)
+    try:
+        chart_options = {'group_by': group_by, 'top': top,
+                         'max_bars': max_bars}
+        echo_stats(packages, graph, chart_options, writer)
+    finally:
+        if writer:
+            writer.close()
+
+
+def echo_stats(packages, graph, chart_options, writer=None):
+    for name_or_url, package, error in packages:
         if not package:
-            secho(u'Invalid name or URL: "{name}"'.format(name=name_or_url),
-                  fg='red', file=sys.stderr)
+            echo_invalid(name_or_url)
             continue
-        try:
-            version_downloads = package.version_downloads
-        except NotFoundError:
-            secho(u'No versions found for "{0}". '
-                  u'Skipping. . .'.format(package.name),
-                  fg='red', file=sys.stderr)
+        if error:
+            echo_skipping(package, error)
+            continue
+        if writer:
+            writer.write(stat_record(package, chart_options['group_by'],
+                                     chart_options['top']))
             continue
-        echo(u"Fetching statistics for '{url}'. . .".format(
-            url=package.package_url))
         min_ver, min_downloads = package.min_version
         max_ver, max_downloads = package.max_version
         if min_ver is None or max_ver is None:
-            raise click.ClickException('Package has no releases')
+            secho(u'"{0}" has no releases. Skipping. . .'.format(package.name),
+                  fg='red', file=sys.stderr)
+            continue
+        echo(u"Fetching statistics for '{url}'. . .".format(
+            url=package.package_url))
         avg_downloads = package.average_downloads
         total = package.downloads
         echo()
@@ -129,8 +416,10 @@ def stat(package, graph):
         echo_header(header)
         if graph:
             echo()
-            echo('Downloads by version')
-            echo(package.chart())
+            by = chart_options['group_by']
+            echo('Downloads by {0}'.format(
+                'version' if by in (None, 'major', 'minor') else by))
+            echo(package.chart(**chart_options))
         echo()
         echo("Min downloads:   {min_downloads:12,} ({min_ver})".format(
             **locals()))
@@ -143,6 +432,48 @@ def stat(package, graph):
         echo()
 
 
+STAT_FIELDS = ('name', 'package_url', 'min_version', 'min_downloads',
+               'max_version', 'max_downloads', 'average_downloads',
+               'downloads', 'downloads_last_day', 'downloads_last_week',
+               'downloads_last_month')
+
+
+def stat_record(package, group_by=None, top=None):
+    """Return a package's statistics. Includes the `STAT_FIELDS` and,
+    for JSON output, a list of releases and, if ``group_by`` or ``top`` is
+    given, a list of groups (see `Package.group_releases`).
+    """
+    min_ver, min_downloads = package.min_version
+    max_ver, max_downloads = package.max_version
+    record = OrderedDict([
+        ('name', package.name),
+        ('package_url', package.package_url),
+        ('min_version', min_ver),
+        ('min_downloads', min_downloads),
+        ('max_version', max_ver),
+        ('max_downloads', max_downloads),
+        ('average_downloads', package.average_downloads),
+        ('downloads', package.downloads),
+        ('downloads_last_day', package.downloads_last_day),
+        ('downloads_last_week', package.downloads_last_week),
+        ('downloads_last_month', package.downloads_last_month),
+        ('releases', [
+            OrderedDict([('version', release.version),
+                         ('upload_time', release.upload_time),
+                         ('downloads', release.downloads)])
+            for release in package.releases]),
+    ])
+    if group_by or top:
+        record['groups'] = [
+            OrderedDict([('group', group.name),
+                         ('upload_time',
+                          from_timestamp(group.timestamp).isoformat()),
+                         ('downloads', group.downloads),
+                         ('releases', group.releases)])
+            for group in package.group_releases(group_by, top)]
+    return record
+
+
 def echo_download_summary(package):
     echo('Last day:    {daily:12,}'.format(daily=package.downloads_last_day))
     echo('Last week:   {weekly:12,}'.format(
@@ -151,12 +482,110 @@ def echo_download_summary(package):
         monthly=package.downloads_last_month))
 
 
+@cli.command()
+@click.option('--percentile', '-p', 'percentiles', multiple=True,
+              type=click.FloatRange(0, 100), metavar='Q',
+              help='Show this percentile of downloads per release. May be '
+                   'repeated. Defaults to 90.')
+@click.option('--sort', '-s', 'sort_by', default=None,
+              type=click.Choice(COMPARE_SORT_FIELDS),
+              help='Sort packages by this column, largest first.')
+@click.option('--jobs', '-j', default=DEFAULT_JOBS, type=click.IntRange(1),
+              help='Number of packages to fetch concurrently.')
+@click.option('--from-file', '--requirement', '-r', 'requirements',
+              multiple=True, type=click.File(),
+              help='Read package names from a requirements file.')
+@click.option('--format', '-f', 'output_format', type=click.Choice(FORMATS),
+              default='text', help='Output format.')
+@click.argument('package', nargs=-1)
+@click.pass_obj
+def compare(obj, package, percentiles, sort_by, jobs, requirements,
+            output_format):
+    """Compare download statistics of several packages.
+
+    Shows the number of releases, total downloads, the median and other
+    percentiles of downloads per release, downloads per day since the first
+    release and the median number of days between releases.
+
+    \b
+    Examples:
+        \b
+        pypi compare requests httpx urllib3
+        pypi compare --sort per_day -p 25 -p 75 -r candidates.txt
+    """
+    if not package and not requirements:
+        raise click.UsageError('Missing argument "package".')
+    names = iter_names(package, requirements)
+    obj['transport'].allow_concurrency(jobs)
+    table = DownloadTable()
+    for name_or_url, pkg, error in iter_packages(
+            names, jobs=jobs, fields=('releases',),
+            **obj['package_options']):
+        if not pkg:
+            echo_invalid(name_or_url)
+        elif error:
+            echo_skipping(pkg, error)
+        else:
+            table.add(pkg.name, pkg.releases)
+    percentiles = percentiles or (90,)
+    rows = table.summary(percentiles=percentiles)
+    if sort_by:
+        rows.sort(key=lambda row: row[sort_by] or 0, reverse=True)
+    fields = compare_fields(percentiles)
+    writer = get_writer(output_format, fields)
+    if writer:
+        try:
+            for row in rows:
+                writer.write(row)
+        finally:
+            writer.close()
+    elif rows:
+        echo(comparison_table(rows, fields))
+
+
+def compare_fields(percentiles):
+    """Return the columns of `DownloadTable.summary` rows."""
+    return (('name', 'releases', 'first_release', 'latest_release',
+             'downloads', 'median') +
+            tuple(percentile_name(q) for q in percentiles) +
+            ('per_day', 'interval_days'))
+
+
+def percentile_name(q):
+    return 'p{0:g}'.format(q)
+
+
+def comparison_table(rows, fields):
+    """Return ``rows`` (dictionaries) as a text table with a column for
+    each of ``fields``.
+    """
+    def cell(value):
+        if value is None:
+            return u'-'
+        if isinstance(value, float):
+            return u'{0:,.1f}'.format(value)
+        if isinstance(value, int):
+            return u'{0:,}'.format(value)
+        return value
+    cells = [[cell(row[field]) for field in fields] for row in rows]
+    widths = [max(len(field), *[len(row[i]) for row in cells])
+              for i, field in enumerate(fields)]
+    # Names are left-aligned, numbers and dates right-aligned
+    template = u'  '.join(
+        u'{{{0}:{1}{2}}}'.format(i, '<' if i == 0 else '>', width)
+        for i, width in enumerate(widths))
+    lines = [style(template.format(*fields), bold=True)]
+    lines.extend(template.format(*row) for row in cells)
+    return u'\n'.join(lines)
+
+
 @cli.command()
 @click.option('--homepage', is_flag=True, default=False)
 @click.argument('package', required=True)
-def browse(package, homepage):
+@click.pass_obj
+def browse(obj, package, homepage):
     """Browse to a package's PyPI or project homepage."""
-    p = Package(package)
+    p = Package(package, fields=('info',), **obj['package_options'])
     try:
         if homepage:
             secho(u'Opening homepage for "{0}"...'.format(package), bold=True)
@@ -166,21 +595,41 @@ def browse(package, homepage):
             url = p.package_url
     except NotFoundError:
         abort_not_found(package)
+    except PackageError as error:
+        raise click.ClickException(str(error))
     click.launch(url)
 
 
 def format_result(result, name_column_width=25):
-    name = result['name']
-    summary_wrapped = textwrap.wrap(
-        result['summary'] or name,
-        width=click.get_terminal_size()[0] - name_column_width - MARGIN
-    )
-    padding = ' ' * (name_column_width + 3)
-    summary = ('\n' + padding).join(summary_wrapped)
-    return u'{0} - {1}'.format(
-        style(name.ljust(name_column_width), fg='cyan', bold=True),
-        summary
-    )
+    return next(format_results([result], name_column_width))
+
+
+def format_results(results, name_column_width=25):
+    """Yield search results formatted as text, as they are consumed from
+    ``results``. The terminal size is only queried once.
+    """
+    wrapper = textwrap.TextWrapper(
+        width=get_terminal_size()[0] - name_column_width - MARGIN)
+    separator = '\n' + ' ' * (name_column_width + 3)
+    name_template = style(u'{0}', fg='cyan', bold=True)
+    for result in results:
+        name = result['name']
+        summary = separator.join(wrapper.wrap(result['summary'] or name))
+        # Release data added by Searcher.enrich
+        details = [result[field] for field in RELEASE_DATA_FIELDS
+                   if result.get(field) and result[field] != 'UNKNOWN']
+        if details:
+            summary += separator + separator.join(
+                wrapper.wrap(u' | '.join(details)))
+        yield u'{0} - {1}'.format(
+            name_template.format(name.ljust(name_column_width)), summary)
+
+
+def iter_search_output(query, results):
+    """Yield the text output of ``search`` in chunks, for the pager."""
+    yield style(u'Search results for "{0}"\n'.format(query), bold=True)
+    for i, text in enumerate(format_results(results)):
+        yield u'\n' + text if i else text
 
 
 @cli.command()
@@ -188,8 +637,20 @@ def format_result(result, name_column_width=25):
               help='Open search results in your web browser.')
 @click.option('--n-results', '-n', default=DEFAULT_SEARCH_RESULTS,
               help='Max number of results to show.')
+@click.option('--local', '-l', is_flag=True, default=False,
+              help='Search the local package index. See "pypi index".')
+@click.option('--summary', '-s', 'search_summary', is_flag=True,
+              default=False, help='Also search package summaries.')
+@click.option('--details', '-d', type=click.IntRange(0), default=0,
+              metavar='N',
+              help='Show the author, home page, license and required Python '
+                   'version of the top N results.')
+@click.option('--format', '-f', 'output_format', type=click.Choice(FORMATS),
+              default='text', help='Output format.')
 @click.argument('query', required=True, type=str)
-def search(query, n_results, web):
+@click.pass_obj
+def search(obj, query, n_results, web, local, search_summary, details,
+           output_format):
     """Search for a pypi package.
 
     \b
@@ -199,21 +660,140 @@ def search(query, n_results, web):
         pypi search 'requests oauth'
         pypi search requests -n 20
         pypi search 'requests toolbelt' --web
+        pypi search requests --local
+        pypi search requests --format jsonl
+        pypi search 'oauth client' --summary --details 5
 
+    In offline mode, the local package index is used if it exists.
     """
     if web:
         secho(u'Opening search page for "{0}"...'.format(query), bold=True)
         url = SEARCH_URL.format(query=urlquote(query))
         click.launch(url)
     else:
-        searcher = Searcher()
-        results = searcher.search(query, n=n_results)
-        first_line = style(u'Search results for "{0}"\n'.format(query),
-                           bold=True)
-        echo_via_pager(
-            first_line +
-            '\n'.join([format_result(result) for result in results])
-        )
+        index = get_index(obj)
+        if local and not index.exists():
+            raise click.ClickException(
+                'The local package index does not exist. '
+                'Create it with "pypi index build".')
+        if not (local or obj['search_options']['offline'] and
+                index.exists()):
+            index = None
+        search_fields = ('name', 'summary') if search_summary else ('name',)
+        searcher = Searcher(index=index, search_fields=search_fields,
+                            **obj['search_options'])
+        try:
+            results = searcher.search(query, n=n_results, enrich=details)
+        except PackageError as error:
+            raise click.ClickException(str(error))
+        fields = SEARCH_FIELDS + (RELEASE_DATA_FIELDS if details else ())
+        writer = get_writer(output_format, fields)
+        if writer:
+            for result in results:
+                writer.write(OrderedDict((field, result.get(field))
+                                         for field in fields))
+            writer.close()
+            return
+        echo_via_pager(iter_search_output(query, results))
+
+
+SEARCH_FIELDS = ('name', 'summary', 'version')
+
+
+def get_index(obj):
+    return PackageIndex(os.path.join(obj['cache_dir'], 'index.sqlite'))
+
+
+@cli.group()
+def index():
+    """Manage the local package index.
+
+    The index contains the names of all packages on PyPI and allows
+    searching without contacting PyPI.
+
+    \b
+    Examples:
+        \b
+        pypi index build
+        pypi index update
+        pypi search --local requests
+    """
+    pass
+
+
+@index.command('build')
+@click.pass_obj
+def index_build(obj):
+    """Download the list of packages and build the index."""
+    index = get_index(obj)
+    secho('Downloading package list. . .', bold=True)
+    count = index.build(Searcher(transport=obj['transport']).client)
+    echo(u'Indexed {0:,} packages.'.format(count))
+
+
+@index.command('update')
+@click.pass_obj
+def index_update(obj):
+    """Update the index with packages created since it was last built or
+    updated.
+    """
+    index = get_index(obj)
+    if not index.exists():
+        raise click.ClickException(
+            'The local package index does not exist. '
+            'Create it with "pypi index build".')
+    count = index.update(Searcher(transport=obj['transport']).client)
+    echo(u'Updated {0:,} packages.'.format(count))
+
+
+def get_mirror(cache_dir):
+    return Mirror(os.path.join(cache_dir, 'mirror'))
+
+
+@cli.group()
+def mirror():
+    """Manage the local mirror of package metadata.
+
+    Once a package is mirrored, other commands use the mirrored metadata
+    instead of contacting PyPI.
+
+    \b
+    Examples:
+        \b
+        pypi mirror sync -r requirements.txt
+        pypi mirror sync Django Flask
+        pypi mirror sync
+    """
+    pass
+
+
+@mirror.command('sync')
+@click.option('--from-file', '--requirement', '-r', 'requirements',
+              multiple=True, type=click.File(),
+              help='Read package names from a requirements file.')
+@click.option('--jobs', '-j', default=DEFAULT_JOBS, type=click.IntRange(1),
+              help='Number of packages to fetch concurrently.')
+@click.argument('package', nargs=-1)
+@click.pass_obj
+def mirror_sync(obj, requirements, jobs, package):
+    """Mirror metadata for packages, refetching only those that changed
+    since the last sync. With no packages, sync the previously mirrored
+    packages. Use - to read package names from stdin.
+    """
+    names = list(iter_names(package, requirements))
+    mirror = get_mirror(obj['cache_dir'])
+    if not names and not mirror.packages:
+        raise click.UsageError('No packages to mirror.')
+    transport = obj['transport']
+    transport.allow_concurrency(jobs)
+    updated, missing = mirror.sync(names or None,
+                                   Searcher(transport=transport).client,
+                                   session=transport, jobs=jobs)
+    for name in missing:
+        secho(u'No versions found for "{0}".'.format(name),
+              fg='red', file=sys.stderr)
+    echo(u'Updated {0:,} of {1:,} packages (serial {2}).'.format(
+        len(updated), len(mirror.packages), mirror.serial))
 
 
 @cli.command()
@@ -223,26 +803,80 @@ def search(query, n_results, web):
               is_flag=True, default=False, help='Show classifiers.')
 @click.option('--long-description', '-L',
               is_flag=True, default=False, help='Show long description.')
-@click.argument('package', nargs=-1, required=True)
-def info(package, long_description, classifiers, license):
+@click.option('--jobs', '-j', default=DEFAULT_JOBS, type=click.IntRange(1),
+              help='Number of packages to fetch concurrently.')
+@click.option('--from-file', '--requirement', '-r', 'requirements',
+              multiple=True, type=click.File(),
+              help='Read package names from a requirements file.')
+@click.option('--format', '-f', 'output_format', type=click.Choice(FORMATS),
+              default='text', help='Output format.')
+@click.argument('package', nargs=-1)
+@click.pass_obj
+def info(obj, package, long_description, classifiers, license, jobs,
+         requirements, output_format):
     """Get info about a package or packages.
+
+    \b
+    Examples:
+        \b
+        pypi info requests
+        pypi info -r requirements.txt
+        pip freeze | pypi info -
+        pypi info --format csv -r requirements.txt
     """
-    client = requests.Session()
-    for name_or_url in package:
-        package = get_package(name_or_url, client)
+    if not package and not requirements:
+        raise click.UsageError('Missing argument "package".')
+    names = iter_names(package, requirements)
+    obj['transport'].allow_concurrency(jobs)
+    packages = iter_packages(names, jobs=jobs, fields=('info',),
+                             **obj['package_options'])
+    fields = INFO_FIELDS
+    if long_description:
+        fields += ('description',)
+    if classifiers:
+        fields += ('classifiers',)
+    if license:
+        fields += ('license',)
+    writer = get_writer(output_format, fields)
+    try:
+        echo_info(packages, long_description, classifiers, license, writer)
+    finally:
+        if writer:
+            writer.close()
+
+
+INFO_FIELDS = ('name', 'version', 'summary', 'downloads_last_day',
+               'downloads_last_week', 'downloads_last_month', 'author',
+               'author_email', 'maintainer', 'maintainer_email',
+               'package_url', 'home_page', 'docs_url')
+
+
+def info_record(package, fields=INFO_FIELDS):
+    info = package.data['info']
+    record = OrderedDict()
+    for field in fields:
+        if field.startswith('downloads_'):
+            record[field] = getattr(package, field)
+        else:
+            record[field] = info.get(field)
+    return record
+
+
+def echo_info(packages, long_description, classifiers, license,
+              writer=None):
+    for name_or_url, package, error in packages:
         if not package:
-            secho(u'Invalid name or URL: "{name}"'.format(name=name_or_url),
-                  fg='red', file=sys.stderr)
+            echo_invalid(name_or_url)
+            continue
+        if error:
+            echo_skipping(package, error)
+            continue
+        if writer:
+            writer.write(info_record(package, writer.fields))
             continue
 
         # Name and summary
-        try:
-            info = package.data['info']
-        except NotFoundError:
-            secho(u'No versions found for "{0}". '
-                  u'Skipping. . .'.format(package.name),
-                  fg='red', file=sys.stderr)
-            continue
+        info = package.data['info']
         echo_header(name_or_url)
         if package.summary:
             echo(package.summary)
@@ -306,6 +940,169 @@ def info(package, long_description, classifiers, license):
         echo()
 
 
+@cli.command()
+@click.option('--depth', '-d', type=click.IntRange(0), default=None,
+              help='Maximum depth of dependencies to show.')
+@click.option('--extra', '-e', 'extras', multiple=True, metavar='NAME',
+              help="Include the package's optional dependencies for an "
+                   "extra. May be repeated.")
+@click.option('--python', 'python_version', default=None, metavar='VERSION',
+              help='Python version for environment markers, e.g. 3.8. '
+                   'Defaults to the running Python.')
+@click.option('--platform', type=click.Choice(sorted(PLATFORMS)),
+              default=None,
+              help='Platform for environment markers. Defaults to the '
+                   'current platform.')
+@click.option('--jobs', '-j', default=DEFAULT_JOBS, type=click.IntRange(1),
+              help='Number of packages to fetch concurrently.')
+@click.option('--format', '-f', 'output_format', type=click.Choice(FORMATS),
+              default='text', help='Output format.')
+@click.argument('package')
+@click.pass_obj
+def deps(obj, package, depth, extras, python_version, platform, jobs,
+         output_format):
+    """Show a package's dependency tree.
+
+    Dependencies are resolved from each package's latest release. A package
+    that appears more than once is expanded only the first time, and marked
+    with (*) after that.
+
+    \b
+    Examples:
+        \b
+        pypi deps requests
+        pypi deps --depth 1 --extra socks requests
+        pypi deps --python 2.7 --platform win32 -f jsonl Flask
+    """
+    obj['transport'].allow_concurrency(jobs)
+    root = get_package(package, fields=('info',), **obj['package_options'])
+    if not root:
+        raise click.BadParameter(u'Invalid name or URL: "{0}"'.format(package),
+                                 param_hint='package')
+    environment = dict(PLATFORMS.get(platform, {}))
+    if python_version:
+        environment['python_version'] = '.'.join(
+            python_version.split('.')[:2])
+        environment['python_full_version'] = python_version
+    nodes = root.dependencies(depth=depth, environment=environment,
+                              extras=extras, jobs=jobs)
+    root_node = nodes[normalize_name(root.name)]
+    if root_node.error:
+        if isinstance(root_node.error, NotFoundError):
+            abort_not_found(package)
+        raise click.ClickException(u'{0}: {1}'.format(package,
+                                                      root_node.error))
+    writer = get_writer(output_format, DEPS_FIELDS)
+    if writer:
+        try:
+            for node in nodes.values():
+                writer.write(deps_record(node))
+        finally:
+            writer.close()
+        return
+    echo(u'\n'.join(dependency_tree(nodes, normalize_name(root.name))))
+
+
+DEPS_FIELDS = ('name', 'version', 'depth', 'requires', 'error')
+
+
+def deps_record(node):
+    return OrderedDict([
+        ('name', node.name),
+        ('version', node.version),
+        ('depth', node.depth),
+        ('requires', [format_requirement(requirement)
+                      for requirement in node.requirements]),
+        ('error', str(node.error) if node.error else None),
+    ])
+
+
+def dependency_tree(nodes, root):
+    """Yield the lines of a text tree of the dependencies in ``nodes``
+    (see `Package.dependencies`), starting at ``root``.
+    """
+    version_template = style(u'{0}', fg='cyan')
+    shown = set([root])
+    node = nodes[root]
+    yield u'{0} {1}'.format(style(node.name, bold=True),
+                            version_template.format(node.version))
+
+    def children(key, prefix):
+        requirements = nodes[key].requirements
+        for i, requirement in enumerate(requirements):
+            last = i == len(requirements) - 1
+            child = normalize_name(requirement.name)
+            node = nodes.get(child)
+            line = prefix + (u'`-- ' if last else u'|-- ')
+            line += format_requirement(requirement)
+            if node is None:
+                yield line
+                continue
+            if node.error:
+                yield line + u' ' + style(u'({0})'.format(node.error),
+                                          fg='red')
+                continue
+            line += u' ' + version_template.format(node.version)
+            if child in shown and node.requirements:
+                yield line + u' (*)'
+                continue
+            shown.add(child)
+            yield line
+            for each in children(child, prefix + (u'    ' if last
+                                                  else u'|   ')):
+                yield each
+
+    for line in children(root, u''):
+        yield line
+
+
+@cli.command()
+@click.option('--host', default='127.0.0.1',
+              help='Address to listen on. Defaults to localhost only.')
+@click.option('--port', '-p', default=0, type=click.IntRange(0, 65535),
+              help='Port to listen on. Defaults to any free port.')
+@click.option('--ttl', default=DEFAULT_SERVE_TTL, type=click.IntRange(0),
+              metavar='SECONDS',
+              help='Refetch packages and search results older than this.')
+@click.option('--max-packages', default=DEFAULT_SERVE_PACKAGES,
+              type=click.IntRange(1),
+              help='Maximum number of packages to keep in memory.')
+@click.pass_obj
+def serve(obj, host, port, ttl, max_packages):
+    """Run a daemon that answers queries from memory.
+
+    The daemon keeps package data, search results and connections to PyPI
+    warm. While it is running, other pypi commands get package data and
+    search results from it. It also answers HTTP GET requests with JSON:
+
+    \b
+        /info/<package>     Package info (see "pypi info --format json")
+        /stat/<package>     Download statistics
+        /search?q=<query>   Search results (also n=<max results>)
+        /pypi/<package>/json  The package's PyPI JSON document
+        /status             Counts of requests and cached packages
+    """
+    server = PackageServer(obj['package_options'], obj['search_options'],
+                           ttl=ttl, max_packages=max_packages)
+    httpd = make_server(server, host, port)
+    url = 'http://{0}:{1}'.format(*httpd.server_address[:2])
+    state_path = os.path.join(obj['cache_dir'], DAEMON_STATE_FILE)
+    state = {'url': url, 'pid': os.getpid(), 'version': __version__,
+             'pypi_url': DEFAULT_PYPI, 'ttl': ttl}
+    _atomic_write(state_path, json.dumps(state).encode('utf-8'))
+    secho(u'Serving on {0}'.format(url), bold=True)
+    echo(u'Press Ctrl+C to stop.')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        # Leave the file alone if another daemon has replaced it
+        if DaemonClient.read_state(state_path) == state:
+            os.remove(state_path)
+
+
 # Utilities
 # #########
 
@@ -321,35 +1118,199 @@ def lazy_property(fn):
     return _lazy_property
 
 
-def _style_value(value):
-    return style('{:,}'.format(value), fg='yellow')
+def default_cache_dir():
+    """Return the default cache directory, respecting ``XDG_CACHE_HOME``."""
+    base = (os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'pypi-cli')
+
+
+def normalize_name(name):
+    """Normalize a package name as described in PEP 503."""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def parse_requirements(lines):
+    """Yield the package names in a requirements file's lines. Options,
+    URLs and paths are skipped.
+    """
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line or line.startswith('-'):
+            continue
+        m = REQUIREMENT_RE.match(line)
+        if m:
+            yield m.group('name')
+
+
+def percentile(values, q):
+    """Return the ``q``th percentile of sorted ``values``, interpolating
+    linearly between the closest values, or `None` if there are none.
+    """
+    if not len(values):
+        return None
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def parse_requires_dist(value):
+    """Parse a ``Requires-Dist`` entry into a `Requirement`, or return
+    `None` if it can't be parsed.
+    """
+    m = REQUIRES_DIST_RE.match(value)
+    if not m:
+        return None
+    extras = tuple(normalize_name(extra.strip()) for extra
+                   in (m.group('extras') or '').split(',') if extra.strip())
+    return Requirement(m.group('name'), extras,
+                       m.group('specifier').replace(' ', ''),
+                       m.group('marker') or None)
+
+
+def format_requirement(requirement):
+    """Return a `Requirement` as a string, without its marker."""
+    extras = (u'[{0}]'.format(','.join(requirement.extras))
+              if requirement.extras else u'')
+    return requirement.name + extras + requirement.specifier
+
+
+def marker_applies(marker, environment=None, extras=()):
+    """Return whether a requirement with the environment ``marker``
+    applies to ``environment`` (a dictionary of marker variables that
+    override those of the running interpreter) when ``extras`` are
+    requested.
+
+    Markers are evaluated with packaging if it is installed. Otherwise only
+    ``extra`` markers are checked, and other conditions are assumed true.
+    """
+    if not marker:
+        return True
+    try:
+        from packaging.markers import Marker, InvalidMarker
+    except ImportError:
+        wanted = MARKER_EXTRA_RE.findall(marker)
+        return not wanted or any(normalize_name(extra) in extras
+                                 for extra in wanted)
+    try:
+        marker = Marker(marker)
+    except InvalidMarker:
+        return False
+    environment = dict(environment or {})
+    return any(marker.evaluate(dict(environment, extra=extra))
+               for extra in tuple(extras) or ('',))
+
+
+def _atomic_write(path, data):
+    """Write bytes to ``path`` such that readers never see a partial file."""
+    import tempfile
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:  # Created by another thread or process
+            pass
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+    try:
+        with io.open(fd, 'wb') as fp:
+            fp.write(data)
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def parse_upload_time(value):
+    """Parse an upload time string into a `datetime`.
+
+    PyPI's ISO 8601 format is parsed directly; other formats fall back to
+    the (much slower) dateutil parser.
+    """
+    m = UPLOAD_TIME_RE.match(value)
+    if m:
+        year, month, day, hour, minute, second, fraction = m.groups()
+        microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+        return datetime(int(year), int(month), int(day), int(hour),
+                        int(minute), int(second), microsecond)
+    from dateutil.parser import parse as dateparse
+    return dateparse(value)
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_timestamp(dt):
+    """Return a `datetime` as a POSIX timestamp. Naive datetimes are
+    assumed to be in UTC.
+    """
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
+
+
+def from_timestamp(timestamp):
+    """Return a POSIX timestamp as a naive `datetime` in UTC."""
+    return _EPOCH + timedelta(seconds=timestamp)
+
+
+def _slim_release_file(obj):
+    if 'upload_time' in obj and 'packagetype' in obj:
+        return dict((key, obj[key]) for key in RELEASE_FILE_FIELDS)
+    return obj
+
+
+def load_package_data(body, fields=None):
+    """Parse a package's JSON document from ``body`` (bytes).
+
+    If ``fields`` is given, only those top-level keys are kept and release
+    files are reduced to `RELEASE_FILE_FIELDS`. If ijson is installed, the
+    document is parsed incrementally so that discarded parts are never
+    built; otherwise, release files are trimmed as they are parsed.
+    """
+    if fields is None:
+        return json.loads(body.decode('utf-8'))
+    try:
+        import ijson
+    except ImportError:
+        data = json.loads(body.decode('utf-8'),
+                          object_hook=_slim_release_file)
+        return dict((key, data[key]) for key in fields if key in data)
+    data = {}
+    for field in fields:
+        stream = io.BytesIO(body)
+        if field == 'releases':
+            data[field] = dict(
+                (version, [_slim_release_file(file_) for file_ in files])
+                for version, files in ijson.kvitems(stream, field,
+                                                    use_float=True))
+        else:
+            for value in ijson.items(stream, field, use_float=True):
+                data[field] = value
+                break
+    return data
 
 
 def bargraph(data, max_key_width=30):
-    """Return a bar graph as a string, given a dictionary of data."""
-    lines = []
-    max_length = min(max(len(key) for key in data.keys()), max_key_width)
-    max_val = max(data.values())
-    max_val_length = max(
-        len(_style_value(val))
-        for val in data.values())
+    """Return a bar graph as a string, given a dictionary of data or a
+    sequence of (key, value) pairs.
+    """
+    items = list(data.items() if hasattr(data, 'items') else data)
+    keys = [key for key, _ in items]
+    values = [value for _, value in items]
+    # Style a template once rather than each value
+    value_template = style(u'{0:,}', fg='yellow')
+    styled_values = [value_template.format(value) for value in values]
+    max_length = min(max(len(key) for key in keys), max_key_width)
+    max_val = max(values)
+    max_val_length = max(len(value) for value in styled_values)
     term_width = get_terminal_size()[0]
     max_bar_width = term_width - MARGIN - (max_length + 3 + max_val_length + 3)
-    template = u"{key:{key_width}} [ {value:{val_width}} ] {bar}"
-    for key, value in data.items():
-        try:
-            bar = int(math.ceil(max_bar_width * value / max_val)) * TICK
-        except ZeroDivisionError:
-            bar = ''
-        line = template.format(
-            key=key[:max_length],
-            value=_style_value(value),
-            bar=bar,
-            key_width=max_length,
-            val_width=max_val_length
-        )
-        lines.append(line)
-    return '\n'.join(lines)
+    template = u"{{0:{0}}} [ {{1:{1}}} ] {{2}}".format(
+        max_length, max_val_length)
+    return '\n'.join(
+        template.format(key[:max_length], styled_value,
+                        TICK * (int(math.ceil(max_bar_width * value / max_val))
+                                if max_val else 0))
+        for key, styled_value, value in zip(keys, styled_values, values))
 
 
 class PackageError(Exception):
@@ -360,81 +1321,980 @@ class NotFoundError(PackageError):
     pass
 
 
+class OfflineError(PackageError):
+    pass
+
+
+class RequestError(PackageError):
+    pass
+
+
+Release = namedtuple('Release',
+                     ['version', 'upload_time', 'downloads', 'n_files'])
+
+# A group of releases (see `Package.group_releases`). ``timestamp`` is the
+# first upload time as a POSIX timestamp, ``releases`` the number of releases
+ReleaseGroup = namedtuple('ReleaseGroup',
+                          ['name', 'timestamp', 'downloads', 'releases'])
+
+Requirement = namedtuple('Requirement',
+                         ['name', 'extras', 'specifier', 'marker'])
+
+# A package in a dependency graph. See Package.dependencies.
+Dependency = namedtuple('Dependency',
+                        ['name', 'version', 'depth', 'requirements', 'error'])
+
+
+class ReleaseTable(object):
+    """A read-only sequence of `Release` records, stored compactly as
+    parallel arrays: a tuple of versions, and arrays of upload times
+    (POSIX timestamps), download counts and file counts.
+    """
+
+    __slots__ = ('versions', 'timestamps', 'downloads', 'n_files')
+
+    def __init__(self, versions=(), timestamps=(), downloads=(), n_files=()):
+        self.versions = tuple(versions)
+        self.timestamps = array('d', timestamps)
+        self.downloads = array('l', downloads)
+        self.n_files = array('l', n_files)
+
+    @classmethod
+    def from_releases(cls, releases):
+        """Build a table from the ``releases`` object of a package's JSON
+        document (a dictionary of version: list of files). Releases are
+        sorted by first upload time; versions with no files are excluded.
+        """
+        rows = []
+        for version, files in releases.items():
+            if not files:
+                continue
+            upload_time, downloads = files[0]['upload_time'], 0
+            for file_ in files:
+                downloads += file_['downloads']
+                if file_['upload_time'] < upload_time:
+                    upload_time = file_['upload_time']
+            rows.append((to_timestamp(parse_upload_time(upload_time)),
+                         version, downloads, len(files)))
+        rows.sort(key=lambda row: row[0])
+        return cls((row[1] for row in rows), (row[0] for row in rows),
+                   (row[2] for row in rows), (row[3] for row in rows))
+
+    def __len__(self):
+        return len(self.versions)
+
+    def __getitem__(self, index):
+        return Release(self.versions[index],
+                       from_timestamp(self.timestamps[index]).isoformat(),
+                       self.downloads[index], self.n_files[index])
+
+    def __iter__(self):
+        for index in range(len(self.versions)):
+            yield self[index]
+
+    def __eq__(self, other):
+        if isinstance(other, ReleaseTable):
+            return (self.versions == other.versions and
+                    self.timestamps == other.timestamps and
+                    self.downloads == other.downloads and
+                    self.n_files == other.n_files)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '<ReleaseTable({0} releases)>'.format(len(self))
+
+
+class DownloadTable(object):
+    """Download counts and upload times of the releases of several
+    packages, stored as columns: two arrays holding the releases of all
+    packages one after another, and an array of offsets where each
+    package's releases start.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.offsets = array('l', [0])
+        self.downloads = array('l')
+        self.timestamps = array('d')
+
+    def add(self, name, releases):
+        """Add a package's `ReleaseTable`."""
+        self.names.append(name)
+        self.downloads.extend(releases.downloads)
+        self.timestamps.extend(releases.timestamps)
+        self.offsets.append(len(self.downloads))
+
+    def __len__(self):
+        return len(self.names)
+
+    def summary(self, percentiles=(90,), now=None):
+        """Return a list of records (one per package, in the order added)
+        of the number of releases, the first and latest release dates,
+        total downloads, the median and ``percentiles`` of downloads per
+        release, downloads per day since the first release, and the median
+        number of days between releases.
+        """
+        now = time.time() if now is None else now
+        rows = []
+        for i, name in enumerate(self.names):
+            start, end = self.offsets[i], self.offsets[i + 1]
+            downloads = sorted(self.downloads[start:end])
+            timestamps = self.timestamps[start:end]
+            total = sum(downloads)
+            row = OrderedDict([
+                ('name', name),
+                ('releases', end - start),
+                ('first_release', None),
+                ('latest_release', None),
+                ('downloads', total),
+                ('median', percentile(downloads, 50)),
+            ])
+            for q in percentiles:
+                row[percentile_name(q)] = percentile(downloads, q)
+            row['per_day'] = None
+            row['interval_days'] = None
+            if timestamps:
+                first, latest = min(timestamps), max(timestamps)
+                row['first_release'] = from_timestamp(first).strftime(
+                    '%Y-%m-%d')
+                row['latest_release'] = from_timestamp(latest).strftime(
+                    '%Y-%m-%d')
+                row['per_day'] = total / max((now - first) / 86400, 1)
+                timestamps = sorted(timestamps)
+                intervals = sorted(map(float.__sub__, timestamps[1:],
+                                       timestamps[:-1]))
+                median = percentile(intervals, 50)
+                row['interval_days'] = (median / 86400
+                                        if median is not None else None)
+            rows.append(row)
+        return rows
+
+
+class RecordWriter(object):
+    """Writes records (dictionaries) to a file as soon as they are ready.
+
+    :param output_format: 'json' (a JSON array), 'jsonl' (JSON Lines) or
+        'csv'. CSV rows have a column for each of ``fields``; lists of
+        strings are joined with newlines.
+    """
+
+    def __init__(self, output_format, fields, file):
+        self.output_format = output_format
+        self.fields = fields
+        self.file = file
+        self.count = 0
+        if output_format == 'csv':
+            import csv
+            self._csv = csv.writer(file, lineterminator='\n')
+            self._csv.writerow(fields)
+
+    def write(self, record):
+        if self.output_format == 'csv':
+            self._csv.writerow([
+                '\n'.join(value) if isinstance(value, list) else value
+                for value in (record.get(field) for field in self.fields)])
+        else:
+            text = json.dumps(record)
+            if self.output_format == 'json':
+                text = ('[' if self.count == 0 else ',\n') + text
+            else:
+                text += '\n'
+            self.file.write(text)
+        self.count += 1
+
+    def close(self):
+        if self.output_format == 'json':
+            self.file.write('[]\n' if self.count == 0 else ']\n')
+
+
+# Caching
+# #######
+
+CacheEntry = namedtuple('CacheEntry',
+                        ['body', 'etag', 'last_modified', 'fetched'])
+
+
+class ResponseCache(object):
+    """An on-disk store of response bodies, keyed by URL.
+
+    Bodies are stored along with their ``ETag`` and ``Last-Modified``
+    validators so that they can be revalidated with conditional requests.
+    Entries that have not been used for ``max_age`` seconds and the least
+    recently used entries beyond ``max_size`` bytes are evicted by `prune`.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_CACHE_SIZE,
+                 max_age=DEFAULT_CACHE_AGE):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def _entry_path(self, key):
+        import hashlib
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest)
+
+    def get(self, key):
+        """Return the `CacheEntry` for ``key`` or `None` if not cached."""
+        path = self._entry_path(key)
+        try:
+            with io.open(path, 'rb') as fp:
+                meta = json.loads(fp.readline().decode('utf-8'))
+                body = fp.read()
+            os.utime(path, None)  # Mark as recently used
+        except (IOError, OSError, ValueError):
+            return None
+        return CacheEntry(body, meta.get('etag'), meta.get('last_modified'),
+                          meta.get('fetched', 0))
+
+    def set(self, key, body, etag=None, last_modified=None, fetched=None):
+        """Store ``body`` (bytes) for ``key`` and return its `CacheEntry`."""
+        fetched = self._format_fetched(
+            fetched if fetched is not None else time.time())
+        entry = CacheEntry(body, etag, last_modified, float(fetched))
+        meta = json.dumps(OrderedDict([('key', key), ('etag', etag),
+                                       ('last_modified', last_modified)]))
+        # `touch` overwrites the fixed-width fetched time in place
+        meta = u'{0}, "fetched": {1}}}'.format(meta[:-1], fetched)
+        _atomic_write(self._entry_path(key),
+                      meta.encode('utf-8') + b'\n' + body)
+        return entry
+
+    @staticmethod
+    def _format_fetched(fetched):
+        return u'{0:20.6f}'.format(fetched)
+
+    def fresh(self, key, max_age=None):
+        """Return the `CacheEntry` for ``key`` if it was fetched or
+        revalidated at most ``max_age`` seconds ago (or at all, if
+        ``max_age`` is `None`), else `None`.
+        """
+        entry = self.get(key)
+        if entry and (max_age is None or
+                      time.time() - entry.fetched <= max_age):
+            return entry
+        return None
+
+    def touch(self, key, entry):
+        """Record that ``entry`` was just revalidated. Only the fetched
+        time in the entry's header is rewritten, not the body.
+        """
+        fetched = self._format_fetched(time.time())
+        value = fetched.encode('ascii')
+        marker = b'"fetched": '
+        try:
+            with io.open(self._entry_path(key), 'r+b') as fp:
+                meta = fp.readline()
+                start = meta.rfind(marker) + len(marker)
+                end = meta.rfind(b'}')
+                if marker in meta and end - start == len(value):
+                    fp.seek(start)
+                    fp.write(value)
+                    return entry._replace(fetched=float(fetched))
+        except (IOError, OSError):
+            pass
+        # Missing or written in another format
+        return self.set(key, entry.body, entry.etag, entry.last_modified,
+                        float(fetched))
+
+    def prune(self):
+        """Evict stale entries and, if the cache is larger than
+        ``max_size``, the least recently used ones.
+        """
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        now = time.time()
+        entries = []
+        for name in names:
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+                if now - st.st_mtime > self.max_age:
+                    os.remove(path)
+                else:
+                    entries.append((st.st_mtime, st.st_size, path))
+            except OSError:
+                pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+# Transport
+# #########
+
+class _Phase(object):
+    """A phase being timed by a `Profiler`. Set ``bytes`` to the number of
+    bytes it transferred or processed.
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.bytes = 0
+
+    def __enter__(self):
+        self.start = self.profiler.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, self.profiler.clock() - self.start,
+                          self.bytes)
+
+
+class _NullPhase(object):
+    """Stands in for a `_Phase` when profiling is off."""
+
+    bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class Profiler(object):
+    """Records the number of calls, time and bytes of each phase of
+    `Package`, `Searcher` and `Transport` operations (see `profile`).
+
+    Phases may overlap, e.g. ``http`` within ``package.fetch``, or run in
+    several threads at once, so their times don't add up to the wall time.
+    If ``cprofile`` is true, the thread that starts the profiler is also
+    profiled with cProfile.
+    """
+
+    def __init__(self, cprofile=False, clock=None):
+        self.clock = clock or getattr(time, 'perf_counter', time.time)
+        self.phases = OrderedDict()
+        self.cprofile = None
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+        self._lock = threading.Lock()
+        self._started = None
+        self.elapsed = None
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def add(self, name, seconds, nbytes=0):
+        with self._lock:
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = [0, 0.0, 0.0, 0]
+            phase[0] += 1
+            phase[1] += seconds
+            phase[2] = max(phase[2], seconds)
+            phase[3] += nbytes
+
+    def start(self):
+        """Start recording phases (and cProfile, if enabled)."""
+        global _profiler
+        _profiler = self
+        self._started = self.clock()
+        if self.cprofile:
+            self.cprofile.enable()
+        return self
+
+    def stop(self):
+        global _profiler
+        if self.cprofile:
+            self.cprofile.disable()
+        self.elapsed = self.clock() - self._started
+        if _profiler is self:
+            _profiler = None
+
+    def summary(self, stats=None):
+        """Return the recorded timings as a dictionary. Times are in
+        milliseconds. ``stats`` (e.g. `Scheduler.stats`) are included as is.
+        """
+        with self._lock:
+            phases = [OrderedDict([
+                ('phase', name), ('calls', calls),
+                ('total_ms', round(total * 1000, 3)),
+                ('mean_ms', round(total * 1000 / calls, 3)),
+                ('max_ms', round(longest * 1000, 3)), ('bytes', nbytes)])
+                for name, (calls, total, longest, nbytes)
+                in self.phases.items()]
+        summary = OrderedDict([('phases', phases)])
+        if self.elapsed is not None:
+            summary['elapsed_ms'] = round(self.elapsed * 1000, 3)
+        if stats is not None:
+            summary['requests'] = dict(stats)
+        return summary
+
+    def report(self, stats=None):
+        """Return the recorded timings as a table."""
+        summary = self.summary(stats)
+        width = max([len(phase['phase']) for phase in summary['phases']] +
+                    [5])
+        lines = [u'{0:{1}} {2:>6} {3:>10} {4:>9} {5:>9} {6:>13}'.format(
+            'Phase', width, 'Calls', 'Total ms', 'Mean ms', 'Max ms', 'Bytes')]
+        for phase in summary['phases']:
+            lines.append(
+                u'{phase:{0}} {calls:6,} {total_ms:10,.1f} {mean_ms:9,.1f} '
+                u'{max_ms:9,.1f} {bytes:13,}'.format(width, **phase))
+        if stats is not None:
+            lines.append(u'Requests: {requests}, retries: {retries}, '
+                         u'throttled: {throttled} ({throttled_time:.1f} s)'
+                         .format(**stats))
+        if 'elapsed_ms' in summary:
+            lines.append(u'Elapsed: {0:,.1f} ms'.format(summary['elapsed_ms']))
+        return u'\n'.join(lines)
+
+
+_profiler = None
+
+
+def profile(name):
+    """Return a context manager that times a phase called ``name`` in the
+    running `Profiler`, if any. Does nothing otherwise.
+    """
+    if _profiler is None:
+        return _NULL_PHASE
+    return _profiler.phase(name)
+
+
+def parse_retry_after(value):
+    """Return the number of seconds to wait given a ``Retry-After`` header
+    value (delay in seconds or HTTP date), or `None` if invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        from email.utils import parsedate_tz, mktime_tz
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0, mktime_tz(date) - time.time())
+
+
+class Scheduler(object):
+    """Runs requests on behalf of a `Transport`.
+
+    Limits the number of concurrent requests per host to ``max_per_host``,
+    limits the overall rate to ``rate`` requests per second (with bursts of
+    up to ``burst`` requests) using a token bucket, and retries failed
+    requests up to ``retries`` times, waiting as requested by
+    ``Retry-After`` headers or else with jittered exponential backoff.
+
+    Counts of requests, retries and throttled waits are kept in `stats`.
+    """
+
+    def __init__(self, max_per_host=DEFAULT_POOL_SIZE, rate=None, burst=None,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 sleep=time.sleep):
+        self.max_per_host = max_per_host
+        self.rate = rate
+        self.burst = burst or max(1, int(rate or 1))
+        self.retries = retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.stats = {'requests': 0, 'retries': 0,
+                      'throttled': 0, 'throttled_time': 0.0}
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._tokens = self.burst
+        self._updated = time.time()
+
+    def _semaphore(self, host):
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(
+                    self.max_per_host)
+            return self._semaphores[host]
+
+    def _throttle(self):
+        """Wait until the token bucket allows another request."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            # Take a token, going into debt if none are available
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            if wait:
+                self.stats['throttled'] += 1
+                self.stats['throttled_time'] += wait
+        if wait:
+            self.sleep(wait)
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def delay(self, attempt, resp=None):
+        """Return the number of seconds to wait before retrying."""
+        import random
+        if resp is not None:
+            retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+            if retry_after is not None:
+                return min(retry_after, MAX_BACKOFF)
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+
+    def run(self, host, send):
+        """Call ``send`` to send a request to ``host`` and return its
+        response, retrying on connection errors, timeouts and
+        `RETRY_STATUSES`. The last response or error is returned or raised
+        once retries are exhausted.
+        """
+        import requests
+        attempt = 0
+        while True:
+            self._throttle()
+            self._count('requests')
+            resp = None
+            try:
+                with self._semaphore(host):
+                    resp = send()
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries:
+                    raise
+            else:
+                if (resp.status_code not in RETRY_STATUSES or
+                        attempt >= self.retries):
+                    return resp
+            self._count('retries')
+            self.sleep(self.delay(attempt, resp))
+            attempt += 1
+
+
+class Transport(object):
+    """HTTP transport shared by `Package` and `Searcher`.
+
+    Wraps a `requests.Session` with a pool of ``pool_size`` keep-alive
+    connections per host, a default ``timeout`` and compressed responses
+    (including brotli, if installed). Requests are run by a `Scheduler`,
+    which handles concurrency limits, rate limiting and retries.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 scheduler=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.scheduler = scheduler or Scheduler(max_per_host=pool_size)
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._make_session()
+        return self._session
+
+    def allow_concurrency(self, n):
+        """Allow at least ``n`` concurrent requests per host, keeping as
+        many connections alive. Must be called before the first request.
+        """
+        self.pool_size = max(self.pool_size, n)
+        self.scheduler.max_per_host = max(self.scheduler.max_per_host, n)
+
+    def _make_session(self):
+        import requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        encodings = ['gzip', 'deflate']
+        try:
+            import brotli  # noqa: Decoded by urllib3 if installed
+            encodings.append('br')
+        except ImportError:
+            pass
+        session.headers.update({
+            'Accept-Encoding': ', '.join(encodings),
+            'User-Agent': 'pypi-cli/{0}'.format(__version__),
+        })
+        return session
+
+    def request(self, method, url, **kwargs):
+        """Send a request and return the response. Raises `RequestError`
+        if no response is received.
+        """
+        import requests
+        kwargs.setdefault('timeout', self.timeout)
+        host = url.split('://', 1)[-1].split('/', 1)[0]
+        try:
+            with profile('http') as phase:
+                resp = self.scheduler.run(
+                    host, lambda: self.session.request(method, url, **kwargs))
+                if _profiler is not None:
+                    # Include downloading the body
+                    phase.bytes = len(resp.content)
+        except requests.RequestException as error:
+            raise RequestError(str(error))
+        if _profiler is not None:
+            # Time until the response headers were received
+            _profiler.add('http.wait', resp.elapsed.total_seconds())
+        return resp
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def server_proxy(self, url):
+        """Return an XML-RPC `ServerProxy` that sends requests using this
+        transport.
+        """
+        if PY2:
+            from xmlrpclib import ServerProxy
+        else:
+            from xmlrpc.client import ServerProxy
+        scheme = url.split('://', 1)[0]
+        return ServerProxy(url, transport=XMLRPCTransport(self, scheme))
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class XMLRPCTransport(object):
+    """Transport for `ServerProxy` that sends requests using a `Transport`
+    rather than a new connection per call.
+    """
+
+    def __init__(self, transport, scheme='https'):
+        self.transport = transport
+        self.scheme = scheme
+
+    def request(self, host, handler, request_body, verbose=False):
+        if PY2:
+            from xmlrpclib import getparser
+        else:
+            from xmlrpc.client import getparser
+        url = '{0}://{1}{2}'.format(self.scheme, host, handler)
+        resp = self.transport.post(url, data=request_body,
+                                   headers={'Content-Type': 'text/xml'})
+        if resp.status_code >= 400:
+            raise RequestError('PyPI returned HTTP {0}'.format(
+                resp.status_code))
+        parser, unmarshaller = getparser()
+        parser.feed(resp.content)
+        parser.close()
+        return unmarshaller.close()
+
+    def close(self):
+        pass
+
+
+def multicall(server):
+    """Return an XML-RPC `MultiCall` that batches calls to ``server`` (a
+    `ServerProxy`) into a single request. Calling it sends the request and
+    returns the results in order; accessing a failed call's result raises
+    its `Fault`.
+    """
+    if PY2:
+        from xmlrpclib import MultiCall
+    else:
+        from xmlrpc.client import MultiCall
+    return MultiCall(server)
+
+
+def xmlrpc_fault():
+    """Return the XML-RPC `Fault` exception class."""
+    if PY2:
+        from xmlrpclib import Fault
+    else:
+        from xmlrpc.client import Fault
+    return Fault
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def default_transport():
+    """Return the `Transport` used by packages and searchers that aren't
+    given a client.
+    """
+    global _default_transport
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = Transport()
+    return _default_transport
+
+
 # API Wrapper
 # ###########
 
 class Package(object):
 
-    def __init__(self, name, client=None, pypi_url=DEFAULT_PYPI):
-        self.client = client or requests.Session()
+    def __init__(self, name, client=None, pypi_url=DEFAULT_PYPI, cache=None,
+                 max_age=None, offline=False, fields=None, mirror=None,
+                 daemon=None):
+        self._client = client
         self.name = name
+        self.pypi_url = pypi_url
         self.url = '{pypi_url}/{name}/json'.format(pypi_url=pypi_url,
                                                    name=name)
+        self.cache = cache
+        self.max_age = max_age
+        self.offline = offline
+        # Top-level keys of the JSON document to keep. See load_package_data.
+        self.fields = fields
+        self.mirror = mirror
+        # If set, a DaemonClient for a running `pypi serve`
+        self.daemon = daemon
 
-    @lazy_property
-    def data(self):
-        resp = self.client.get(self.url)
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = default_transport()
+        return self._client
+
+    def fetch(self):
+        """Return the raw body of the package's JSON document.
+
+        If a `Mirror` of the same index is set and contains the package, the
+        mirrored document is used. Next, if a `DaemonClient` is set that
+        serves the same index and ``max_age``, the document is requested from
+        the daemon; if it isn't available, PyPI is contacted as usual. If a
+        `ResponseCache` is set, cached documents no older than ``max_age``
+        seconds are used without contacting PyPI. Otherwise, the cached
+        document is revalidated with a conditional request and reused if it
+        has not changed. In ``offline`` mode, PyPI is never contacted and
+        `OfflineError` is raised if the document isn't cached.
+        """
+        if self.mirror and self.mirror.pypi_url == self.pypi_url:
+            with profile('mirror.read'):
+                body = self.mirror.get(self.name)
+            if body is not None:
+                return body
+        if self.daemon and self.daemon.serves(self.pypi_url, self.max_age):
+            with profile('daemon.read'):
+                body = self.daemon.get(self.name)
+            if body is not None:
+                return body
+        if self.cache and (self.offline or self.max_age is not None):
+            with profile('cache.read'):
+                entry = self.cache.fresh(self.url, self.max_age)
+            if entry:
+                return entry.body
+        if self.offline:
+            raise OfflineError('Package not available offline')
+        entry = None
+        if self.cache:
+            with profile('cache.read'):
+                entry = self.cache.get(self.url)
+        headers = {}
+        if entry and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        resp = self.client.get(self.url, headers=headers)
         if resp.status_code == 404:
             raise NotFoundError('Package not found')
-        return resp.json()
+        if resp.status_code >= 400:
+            raise RequestError('PyPI returned HTTP {0}'.format(
+                resp.status_code))
+        if resp.status_code == 304 and entry:
+            self.cache.touch(self.url, entry)
+            return entry.body
+        body = resp.content
+        if self.cache:
+            with profile('cache.write'):
+                self.cache.set(self.url, body,
+                               etag=resp.headers.get('ETag'),
+                               last_modified=resp.headers.get('Last-Modified'))
+        return body
 
     @lazy_property
-    def versions(self):
-        """Return a list of versions, sorted by release datae."""
-        return [k for k, v in self.release_info]
+    def data(self):
+        return self._load()
+
+    def _load(self):
+        with profile('package.fetch') as phase:
+            body = self.fetch()
+            phase.bytes = len(body)
+        with profile('package.parse') as phase:
+            phase.bytes = len(body)
+            return load_package_data(body, self.fields)
 
     @lazy_property
+    def releases(self):
+        """Return a `ReleaseTable` of `Release` records, sorted by first
+        upload time. Versions with no uploaded files are excluded.
+        """
+        data = self.data
+        with profile('package.releases'):
+            return ReleaseTable.from_releases(data['releases'])
+
+    def compact(self):
+        """Build the release table and drop everything but the ``info``
+        block from the parsed JSON document, to reduce the memory used by a
+        long-lived package.
+
+        :return: The package.
+        """
+        self.releases
+        data = self.data
+        for key in list(data):
+            if key != 'info':
+                del data[key]
+        return self
+
+    @property
+    def versions(self):
+        """Return a list of versions, sorted by release date."""
+        return list(self.releases.versions)
+
+    @property
     def version_downloads(self):
         """Return a dictionary of version:download_count pairs."""
-        ret = OrderedDict()
-        for release, info in self.release_info:
-            download_count = sum(file_['downloads'] for file_ in info)
-            ret[release] = download_count
-        return ret
+        return OrderedDict(zip(self.releases.versions,
+                               self.releases.downloads))
+
+    @property
+    def version_dates(self):
+        return OrderedDict(
+            (version, from_timestamp(timestamp)) for version, timestamp
+            in zip(self.releases.versions, self.releases.timestamps))
 
     @property
     def release_info(self):
-        release_info = self.data['releases']
-        # filter out any versions that have no releases
-        filtered = [(ver, releases) for ver, releases in release_info.items()
-                    if len(releases) > 0]
-        # sort by first upload date of each release
-        return sorted(filtered, key=lambda x: x[1][0]['upload_time'])
+        """Return a list of (version, files) pairs, sorted by release date.
+        Versions with no files are excluded.
 
-    @lazy_property
-    def version_dates(self):
-        ret = OrderedDict()
-        for release, info in self.release_info:
-            if info:
-                upload_time = dateparse(info[0]['upload_time'])
-                ret[release] = upload_time
-        return ret
-
-    def chart(self):
-        def style_version(version):
-            return style(version, fg='cyan', bold=True)
-
-        data = OrderedDict()
-        for version, dl_count in self.version_downloads.items():
-            date = self.version_dates.get(version)
-            date_formatted = ''
-            if date:
-                date_formatted = time.strftime(
-                    DATE_FORMAT, self.version_dates[version].timetuple())
-            key = "{0:20} {1}".format(
-                style_version(version),
-                date_formatted
-            )
-            data[key] = dl_count
-        return bargraph(data, max_key_width=20 + _COLOR_LEN + _BOLD_LEN)
+        Deprecated: use `releases`. Not available after `compact`.
+        """
+        import warnings
+        warnings.warn('Package.release_info is deprecated; use '
+                      'Package.releases instead.', DeprecationWarning,
+                      stacklevel=2)
+        files = self.data['releases']
+        return [(version, files[version])
+                for version in self.releases.versions]
+
+    def group_releases(self, by=None, top=None):
+        """Return releases combined into groups, in order of first upload.
+
+        :param by: 'major' or 'minor' to group by version (e.g. '1' or
+            '1.2'), or 'month' or 'quarter' to group by date of first upload
+            (e.g. '2014-06' or '2014-Q2'). If `None`, each release is its own
+            group. Versions that don't follow PEP 440 are grouped as
+            'unversioned'.
+        :param top: If given, only the ``top`` groups with the most
+            downloads are kept, and the rest are combined into an 'other'
+            group.
+        :return: A list of `ReleaseGroup` records.
+        """
+        if by not in (None,) + GROUP_BY:
+            raise ValueError('Invalid group_by: {0!r}'.format(by))
+        table = self.releases
+        groups = OrderedDict()
+        for version, timestamp, downloads in zip(
+                table.versions, table.timestamps, table.downloads):
+            if by is None:
+                key = version
+            elif by in ('major', 'minor'):
+                m = VERSION_RE.match(version)
+                if not m:
+                    key = 'unversioned'
+                elif by == 'major' or m.group('minor') is None:
+                    key = m.group('major')
+                else:
+                    key = '{0}.{1}'.format(m.group('major'), m.group('minor'))
+            else:
+                date = from_timestamp(timestamp)
+                if by == 'month':
+                    key = '{0:%Y-%m}'.format(date)
+                else:
+                    key = '{0}-Q{1}'.format(date.year, (date.month + 2) // 3)
+            if key in groups:
+                group = groups[key]
+                groups[key] = group._replace(
+                    downloads=group.downloads + downloads,
+                    releases=group.releases + 1)
+            else:
+                groups[key] = ReleaseGroup(key, timestamp, downloads, 1)
+        result = list(groups.values())
+        if top and len(result) > top:
+            keep = set(id(group) for group in heapq.nlargest(
+                top, result, key=lambda group: group.downloads))
+            rest = [group for group in result if id(group) not in keep]
+            result = [group for group in result if id(group) in keep]
+            result.append(ReleaseGroup(
+                'other', min(group.timestamp for group in rest),
+                sum(group.downloads for group in rest),
+                sum(group.releases for group in rest)))
+        return result
+
+    def chart(self, group_by=None, top=None, max_bars=None):
+        """Return a bar graph of downloads by version.
+
+        :param group_by: Group releases. See `group_releases`.
+        :param top: Only show the top groups. See `group_releases`.
+        :param max_bars: If there are more releases than this, consecutive
+            releases are combined so that there are at most ``max_bars``
+            bars, labeled with a range of versions.
+        """
+        if group_by or top:
+            groups = self.group_releases(group_by, top)
+            labels = [group.name for group in groups]
+            timestamps = [group.timestamp for group in groups]
+            downloads = [group.downloads for group in groups]
+        else:
+            table = self.releases
+            labels, timestamps, downloads = (table.versions, table.timestamps,
+                                             table.downloads)
+        with profile('package.chart'):
+            return self._chart(labels, timestamps, downloads, max_bars)
+
+    def _chart(self, labels, timestamps, downloads, max_bars):
+        rows = list(zip(labels, timestamps, downloads))
+        if max_bars and len(rows) > max_bars:
+            size = int(math.ceil(len(rows) / max_bars))
+            rows = [(chunk[0][0] if len(chunk) == 1 else
+                     u'{0}..{1}'.format(chunk[0][0], chunk[-1][0]),
+                     chunk[0][1], sum(row[2] for row in chunk))
+                    for chunk in (rows[i:i + size]
+                                  for i in range(0, len(rows), size))]
+        version_template = style(u'{0}', fg='cyan', bold=True)
+        # Size the label column so that range labels don't push the dates
+        # out of the key
+        width = max([20] + [len(version_template.format(row[0]))
+                            for row in rows])
+        key_template = u'{{0:{0}}} {{1}}'.format(width)
+        data = [(key_template.format(
+                    version_template.format(label),
+                    from_timestamp(timestamp).strftime(DATE_FORMAT)),
+                 count)
+                for label, timestamp, count in rows]
+        return bargraph(data, max_key_width=max(len(key) for key, _ in data))
 
     @lazy_property
     def downloads(self):
-        """Total download count.
-
-        :return: A tuple of the form (version, n_downloads)
-        """
-        return sum(self.version_downloads.values())
+        """Total download count."""
+        return sum(self.releases.downloads)
 
     @lazy_property
     def max_version(self):
@@ -442,23 +2302,100 @@ class Package(object):
 
         :return: A tuple of the form (version, n_downloads)
         """
-        data = self.version_downloads
-        if not data:
+        downloads = self.releases.downloads
+        if not downloads:
             return None, 0
-        return max(data.items(), key=lambda item: item[1])
+        index = max(range(len(downloads)), key=downloads.__getitem__)
+        return self.releases.versions[index], downloads[index]
 
     @lazy_property
     def min_version(self):
         """Version with the fewest downloads."""
-        data = self.version_downloads
-        if not data:
+        downloads = self.releases.downloads
+        if not downloads:
             return (None, 0)
-        return min(data.items(), key=lambda item: item[1])
+        index = min(range(len(downloads)), key=downloads.__getitem__)
+        return self.releases.versions[index], downloads[index]
 
     @lazy_property
     def average_downloads(self):
         """Average number of downloads."""
-        return int(self.downloads / len(self.versions))
+        if not self.releases:
+            return 0
+        return int(self.downloads / len(self.releases))
+
+    @property
+    def requires_dist(self):
+        return self.data['info'].get('requires_dist') or []
+
+    def requirements(self, environment=None, extras=()):
+        """Return the package's direct requirements as `Requirement`
+        records, excluding those whose environment markers don't apply.
+        See `marker_applies`.
+        """
+        result = []
+        for value in self.requires_dist:
+            requirement = parse_requires_dist(value)
+            if requirement and marker_applies(requirement.marker,
+                                              environment, extras):
+                result.append(requirement)
+        return result
+
+    def dependencies(self, depth=None, environment=None, extras=(),
+                     jobs=DEFAULT_JOBS):
+        """Walk the package's dependency graph breadth-first, fetching the
+        packages at each level concurrently (up to ``jobs`` at a time).
+        Each distinct (normalized) name is fetched once.
+
+        :param depth: If given, packages more than ``depth`` levels below
+            this one are not fetched.
+        :param environment: Environment marker variables used to filter
+            requirements. See `marker_applies`.
+        :param extras: Extras of this package to include.
+        :return: An `OrderedDict` of normalized name: `Dependency`, in
+            breadth-first order, starting with this package.
+            ``requirements`` is empty for packages at the maximum depth, and
+            ``error`` is the `PackageError` raised while fetching a package.
+        """
+        root = normalize_name(self.name)
+        packages = {root: self}
+        wanted_extras = {root: set(normalize_name(e) for e in extras)}
+        nodes = OrderedDict()
+        level, current = 0, [root]
+        while current:
+            expand = depth is None or level < depth
+            fetched = imap(lambda key: (key, _prefetch(packages[key])),
+                           current, jobs)
+            current = []
+            for key, error in fetched:
+                package = packages[key]
+                if error:
+                    nodes[key] = Dependency(package.name, None, level, [],
+                                            error)
+                    continue
+                info = package.data['info']
+                requirements = (package.requirements(
+                    environment, wanted_extras[key]) if expand else [])
+                nodes[key] = Dependency(info.get('name') or package.name,
+                                        info.get('version'), level,
+                                        requirements, None)
+                for requirement in requirements:
+                    child = normalize_name(requirement.name)
+                    if child in packages:
+                        # Extras only matter if the child isn't expanded yet
+                        if child not in nodes:
+                            wanted_extras[child].update(requirement.extras)
+                        continue
+                    packages[child] = Package(
+                        child, client=self.client,
+                        pypi_url=self.pypi_url, cache=self.cache,
+                        max_age=self.max_age, offline=self.offline,
+                        fields=('info',), mirror=self.mirror,
+                        daemon=self.daemon)
+                    wanted_extras[child] = set(requirement.extras)
+                    current.append(child)
+            level += 1
+        return nodes
 
     @property
     def author(self):
@@ -535,40 +2472,739 @@ class Searcher(object):
     CONTAINS_NAME_MULT = 4
     NAME_IN_SUMMARY_MULT = 2
 
-    def __init__(self, pypi_url=DEFAULT_PYPI, client=None):
+    def __init__(self, pypi_url=DEFAULT_PYPI, client=None, cache=None,
+                 max_age=None, offline=False, index=None, transport=None,
+                 search_fields=('name',), daemon=None):
         self.pypi_url = pypi_url
-        self.client = client or ServerProxy(pypi_url)
+        # If set, a DaemonClient for a running `pypi serve`
+        self.daemon = daemon
+        self._client = client
+        self.transport = transport
+        # Package metadata fields searched on PyPI, e.g. 'name' and 'summary'
+        self.search_fields = tuple(search_fields)
+        # If set, a PackageIndex that is searched instead of PyPI
+        self.index = index
+        self.cache = cache
+        self.max_age = max_age
+        self.offline = offline
+
+    @property
+    def client(self):
+        if self._client is None:
+            transport = self.transport or default_transport()
+            self._client = transport.server_proxy(self.pypi_url)
+        return self._client
+
+    def tokenize(self, query):
+        return [each.strip() for each in query.strip().lower().split()
+                if each not in self.STOP_WORDS]
+
+    @staticmethod
+    def compile(tokens):
+        """Return a list of ``(token, pattern)`` pairs for `score`."""
+        return [(token, re.compile(re.escape(token))) for token in tokens]
 
     def score(self, tokens, record):
+        """Score a search result.
+
+        :param tokens: Query tokens or the output of `compile`.
+        """
         score = 0
         name, summary = record['name'].lower(), record['summary']
+        if summary is not None:
+            summary = summary.lower()
         for token in tokens:
+            token, pattern = (token if isinstance(token, tuple)
+                              else (token, re.compile(re.escape(token))))
             qtf = 0
             if token == name:
                 qtf += self.NAME_MATCH_WEIGHT
             else:
-                n_name_matches = len(re.compile(token).findall(name))
+                n_name_matches = len(pattern.findall(name))
                 qtf += self.CONTAINS_NAME_MULT * n_name_matches
-            if record['summary'] is not None:
-                summary_matches = re.compile(token).findall(summary.lower())
-                qtf += 2 * len(summary_matches)
+            if summary is not None:
+                summary_matches = pattern.findall(summary)
+                qtf += self.NAME_IN_SUMMARY_MULT * len(summary_matches)
             score += qtf
         return score
 
-    def search(self, query, n=None):
-        tokens = [each.strip() for each in query.strip().lower().split()
-                  if each not in self.STOP_WORDS]
-        results = self.client.search({'name': tokens}, 'and')
-        visited = []
+    def rank(self, tokens, results, n=None):
+        """Deduplicate results by name and return them ordered by score,
+        limited to the top ``n``. Results with equal scores keep their
+        original order.
+        """
+        visited = set()
         nd = []
         for result in results:
             name = result['name']
-            try:
-                visited.index(name)
-            except ValueError:
+            if name not in visited:
                 nd.append(result)
-                visited.append(name)
-        ranked = [(self.score(tokens, result), result) for result in nd]
-        sorted_results = sorted(ranked, reverse=True, key=lambda t: t[0])
-        limited_results = sorted_results[:n] if n else sorted_results
-        return (result for score, result in limited_results)
+                visited.add(name)
+        patterns = self.compile(tokens)
+
+        def key(result):
+            return self.score(patterns, result)
+        if n:
+            return heapq.nlargest(n, nd, key=key)
+        return sorted(nd, key=key, reverse=True)
+
+    def search(self, query, n=None, enrich=0):
+        """Return a generator of search results, ranked by `score`.
+
+        :param enrich: Number of top results to add release data to. See
+            `enrich`.
+        """
+        tokens = self.tokenize(query)
+        results = self._search(tokens, n=n)
+        with profile('search.rank'):
+            ranked = self.rank(tokens, results, n=n)
+        if enrich:
+            ranked = self.enrich(ranked, n=enrich)
+        return (result for result in ranked)
+
+    def enrich(self, results, n=None):
+        """Add `RELEASE_DATA_FIELDS` to the first ``n`` of ``results`` (a
+        list) from the release data of their versions, which is fetched in a
+        single XML-RPC request. Results without a version or whose release
+        data can't be fetched are left as is, as are all results in offline
+        mode or if the request fails.
+
+        :return: ``results``.
+        """
+        targets = [result for result in results[:n] if result.get('version')]
+        if not targets or self.offline:
+            return results
+        batch = multicall(self.client)
+        for result in targets:
+            batch.release_data(result['name'], result['version'])
+        fault = xmlrpc_fault()
+        try:
+            with profile('search.enrich'):
+                release_data = batch()
+        except (fault, PackageError):
+            return results
+        for i, result in enumerate(targets):
+            try:
+                data = release_data[i]
+            except fault:
+                continue
+            for field in RELEASE_DATA_FIELDS:
+                result[field] = (data or {}).get(field)
+        return results
+
+    def _search(self, tokens, n=None):
+        """Return the raw search results for ``tokens`` from the local
+        index, if set, or PyPI, using the cache according to ``max_age`` and
+        ``offline`` (see `Package.fetch`).
+        """
+        if self.index:
+            with profile('index.search'):
+                return self.index.search(tokens, n=n)
+        if self.daemon and self.daemon.serves(self.pypi_url, self.max_age):
+            with profile('daemon.read'):
+                results = self.daemon.search(u' '.join(tokens), n,
+                                             self.search_fields)
+            if results is not None:
+                return results
+        key = u'search:{0}:{1}'.format(self.pypi_url, u' '.join(tokens))
+        if self.search_fields != ('name',):
+            key += u':' + u','.join(self.search_fields)
+        if self.cache and (self.offline or self.max_age is not None):
+            with profile('cache.read'):
+                entry = self.cache.fresh(key, self.max_age)
+            if entry:
+                return json.loads(entry.body.decode('utf-8'))
+        if self.offline:
+            raise OfflineError('Search results not available offline')
+        with profile('search.fetch'):
+            if len(self.search_fields) == 1:
+                results = self.client.search({self.search_fields[0]: tokens},
+                                             'and')
+            else:
+                # Search each field in one request
+                batch = multicall(self.client)
+                for field in self.search_fields:
+                    batch.search({field: tokens}, 'and')
+                results = [result for field_results in batch()
+                           for result in field_results]
+        if self.cache:
+            with profile('cache.write'):
+                self.cache.set(key, json.dumps(results).encode('utf-8'))
+        return results
+
+
+class Mirror(object):
+    """A local store of JSON documents for a set of packages.
+
+    `sync` uses the XML-RPC changelog to refetch only the packages that
+    changed since the last recorded serial.
+    """
+
+    def __init__(self, path, pypi_url=DEFAULT_PYPI):
+        self.path = path
+        self.pypi_url = pypi_url
+        self._state = None
+        self._names = None
+
+    def exists(self):
+        return os.path.exists(self._state_path)
+
+    @property
+    def _state_path(self):
+        return os.path.join(self.path, 'state.json')
+
+    def _document_path(self, name):
+        return os.path.join(self.path, 'packages',
+                            normalize_name(name) + '.json')
+
+    @property
+    def state(self):
+        if self._state is None:
+            try:
+                with io.open(self._state_path, 'rb') as fp:
+                    self._state = json.loads(fp.read().decode('utf-8'))
+            except (IOError, OSError, ValueError):
+                self._state = {'serial': None, 'packages': []}
+        return self._state
+
+    @property
+    def serial(self):
+        """The changelog serial as of the last sync, or `None`."""
+        return self.state['serial']
+
+    @property
+    def packages(self):
+        """The names of the mirrored packages."""
+        return self.state['packages']
+
+    def get(self, name):
+        """Return the mirrored JSON document (bytes) for a package, or
+        `None` if it isn't mirrored.
+        """
+        if self._names is None:
+            self._names = set(normalize_name(n) for n in self.packages)
+        if normalize_name(name) not in self._names:
+            return None
+        try:
+            with io.open(self._document_path(name), 'rb') as fp:
+                return fp.read()
+        except (IOError, OSError):
+            return None
+
+    def sync(self, names, client, session=None, jobs=DEFAULT_JOBS):
+        """Mirror the packages in ``names`` (or the previously mirrored
+        packages, if `None`), fetching only those that aren't mirrored yet
+        or that appear in the changelog since the last sync.
+
+        :param client: An XML-RPC `ServerProxy` for PyPI.
+        :param session: A `Transport` or `requests.Session` for fetching
+            documents.
+        :return: A tuple of the form (updated_names, missing_names)
+        """
+        if names is None:
+            names = self.packages
+        names = list(OrderedDict((normalize_name(name), name)
+                                 for name in names).values())
+        # Get the serial first so that no changes are missed by the next sync
+        last_serial = client.changelog_last_serial()
+        serial = self.serial
+        changed = set()
+        if serial is None:
+            serial = last_serial
+        # PyPI limits the number of changelog entries returned per call
+        while serial < last_serial:
+            changes = client.changelog_since_serial(serial)
+            if not changes:
+                break
+            for change in changes:
+                changed.add(normalize_name(change[0]))
+                serial = max(serial, change[4])
+        stale = [name for name in names
+                 if normalize_name(name) in changed or
+                 not os.path.exists(self._document_path(name))]
+        session = session or default_transport()
+        packages = [Package(name, client=session, pypi_url=self.pypi_url)
+                    for name in stale]
+        updated, missing = [], []
+        for package, result in zip(packages, imap(_fetch, packages, jobs)):
+            if isinstance(result, NotFoundError):
+                missing.append(package.name)
+                try:
+                    os.remove(self._document_path(package.name))
+                except OSError:
+                    pass
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                _atomic_write(self._document_path(package.name), result)
+                updated.append(package.name)
+        missing = set(missing)
+        packages = [name for name in names if name not in missing]
+        # Remove the documents of packages that are no longer mirrored
+        kept = set(normalize_name(name) for name in packages)
+        for name in self.packages:
+            if normalize_name(name) not in kept:
+                try:
+                    os.remove(self._document_path(name))
+                except OSError:
+                    pass
+        self._state = {'serial': serial, 'packages': packages}
+        self._names = kept
+        _atomic_write(self._state_path,
+                      json.dumps(self._state).encode('utf-8'))
+        return updated, sorted(missing)
+
+
+class PackageIndex(object):
+    """A local index of package names, stored in a SQLite database, that
+    can be searched like PyPI's XML-RPC ``search`` on the ``name`` field.
+    Summaries are not available from PyPI's package list, so they are not
+    indexed.
+
+    The index is kept current using the XML-RPC changelog, starting from
+    the serial recorded when it was built.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _connect(self, bulk=False):
+        import sqlite3
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS packages '
+                         '(id INTEGER PRIMARY KEY, name TEXT UNIQUE)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                         '(key TEXT PRIMARY KEY, value TEXT)')
+            try:
+                # A trigram index speeds up substring searches; requires
+                # SQLite >= 3.34 with FTS5
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS names "
+                             "USING fts5(name, content='packages', "
+                             "content_rowid='id', tokenize='trigram')")
+            except sqlite3.OperationalError:
+                self._table = 'packages'
+            else:
+                self._table = 'names'
+            if self._table == 'names' and not bulk:
+                conn.execute(
+                    'CREATE TRIGGER IF NOT EXISTS packages_insert '
+                    'AFTER INSERT ON packages BEGIN '
+                    'INSERT INTO names (rowid, name) '
+                    'VALUES (new.id, new.name); END')
+                conn.execute(
+                    'CREATE TRIGGER IF NOT EXISTS packages_delete '
+                    'AFTER DELETE ON packages BEGIN '
+                    "INSERT INTO names (names, rowid, name) "
+                    "VALUES ('delete', old.id, old.name); END")
+        return conn
+
+    @property
+    def serial(self):
+        """The last changelog serial applied to the index, or `None`."""
+        if not self.exists():
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key = 'serial'").fetchone()
+        finally:
+            conn.close()
+        return int(row[0]) if row else None
+
+    def _set_serial(self, conn, serial):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) "
+                     "VALUES ('serial', ?)", (str(serial),))
+
+    def build(self, client):
+        """(Re)build the index from the list of all packages.
+
+        :param client: An XML-RPC `ServerProxy` for PyPI.
+        :return: The number of indexed packages.
+        """
+        # Get the serial first so that no changes are missed by `update`
+        serial = client.changelog_last_serial()
+        names = client.list_packages()
+        if self.exists():
+            os.remove(self.path)
+        conn = self._connect(bulk=True)
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT OR IGNORE INTO packages (name) VALUES (?)',
+                    ((name,) for name in names))
+                if self._table == 'names':
+                    conn.execute("INSERT INTO names (names) "
+                                 "VALUES ('rebuild')")
+                self._set_serial(conn, serial)
+        finally:
+            conn.close()
+        # Create the triggers that keep the trigram index up to date
+        self._connect().close()
+        return len(names)
+
+    def update(self, client):
+        """Apply changelog entries since the last build or update.
+
+        :param client: An XML-RPC `ServerProxy` for PyPI.
+        :return: The number of changed packages.
+        """
+        serial = self.serial
+        if serial is None:
+            return self.build(client)
+        last_serial = client.changelog_last_serial()
+        changed = set()
+        conn = self._connect()
+        try:
+            # PyPI limits the number of changelog entries returned per call
+            while serial < last_serial:
+                changes = client.changelog_since_serial(serial)
+                if not changes:
+                    break
+                with conn:
+                    for name, version, _, action, change_serial in changes:
+                        # PyPI logs 'remove project'; older entries, 'remove'
+                        if (action == 'remove project' or
+                                action == 'remove' and not version):
+                            conn.execute(
+                                'DELETE FROM packages WHERE name = ?',
+                                (name,))
+                        else:
+                            conn.execute(
+                                'INSERT OR IGNORE INTO packages (name) '
+                                'VALUES (?)', (name,))
+                        changed.add(name)
+                        serial = max(serial, change_serial)
+                    self._set_serial(conn, serial)
+        finally:
+            conn.close()
+        return len(changed)
+
+    def search(self, tokens, n=None):
+        """Return records for packages whose names contain all ``tokens``
+        (case-insensitive), in the format of XML-RPC search results.
+
+        Records are ranked in the database using the same weights as
+        `Searcher.score`, so that only the top ``n`` are returned.
+        """
+        where, score, params = [], [], []
+        for token in tokens:
+            # LIKE can use the trigram index but treats '_' and '%' as
+            # wildcards, so also check for the exact substring
+            where.append('name LIKE ? AND instr(lower(name), ?)')
+            params.extend([u'%{0}%'.format(token), token])
+        for token in tokens:
+            # Exact match or number of occurrences in the name
+            score.append('CASE WHEN lower(name) = ? THEN {0} ELSE {1} * '
+                         '((length(name) - length(replace(lower(name), ?, '
+                         "''))) / ?) END".format(
+                             Searcher.NAME_MATCH_WEIGHT,
+                             Searcher.CONTAINS_NAME_MULT))
+            params.extend([token, token, len(token)])
+        conn = self._connect()
+        query = 'SELECT name FROM {0}'.format(self._table)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        if score:
+            query += ' ORDER BY ' + ' + '.join(score) + ' DESC, rowid'
+        if n:
+            query += ' LIMIT {0:d}'.format(n)
+        try:
+            # The package list doesn't include summaries
+            return [{'name': name, 'summary': None}
+                    for name, in conn.execute(query, params)]
+        finally:
+            conn.close()
+
+
+# Serving
+# #######
+
+class _WarmPackage(Package):
+    """A `Package` that keeps its raw JSON document and its records as
+    encoded JSON. Only the parts of the parsed document that the records
+    need are kept (see `Package.compact`).
+    """
+
+    def __init__(self, name, **kwargs):
+        kwargs.setdefault('fields', ('info', 'releases'))
+        super(_WarmPackage, self).__init__(name, **kwargs)
+        self._records = {}
+
+    @lazy_property
+    def body(self):
+        return super(_WarmPackage, self).fetch()
+
+    def fetch(self):
+        return self.body
+
+    def record(self, kind):
+        """Return the package's 'info' or 'stat' record as JSON (bytes)."""
+        if kind not in self._records:
+            record = info_record(self) if kind == 'info' else stat_record(self)
+            self._records[kind] = json.dumps(record).encode('utf-8')
+        return self._records[kind]
+
+
+class PackageServer(object):
+    """Answers queries for package data and search results, keeping
+    up to ``max_packages`` packages and their parsed data in memory for
+    ``ttl`` seconds. Used by ``pypi serve`` (see `make_server`).
+
+    :param package_options: Keyword arguments for `Package`.
+    :param search_options: Keyword arguments for `Searcher`.
+    """
+
+    def __init__(self, package_options=None, search_options=None,
+                 ttl=DEFAULT_SERVE_TTL, max_packages=DEFAULT_SERVE_PACKAGES,
+                 clock=time.time):
+        # Never ask a daemon (possibly this one) for data
+        self.package_options = dict(package_options or {}, daemon=None)
+        self.search_options = dict(search_options or {}, daemon=None)
+        self.ttl = ttl
+        self.max_packages = max_packages
+        self.clock = clock
+        self.started = clock()
+        self.stats = {'requests': 0, 'hits': 0, 'misses': 0}
+        self._packages = OrderedDict()
+        self._searches = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, store, key, load):
+        """Return the value for ``key`` in ``store``, an `OrderedDict` of
+        key: (loaded, value) in least recently used order, calling ``load``
+        if it is missing or older than ``ttl``.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = store.pop(key, None)
+            if entry and now - entry[0] < self.ttl:
+                store[key] = entry
+                self.stats['hits'] += 1
+                return entry[1]
+            self.stats['misses'] += 1
+        value = load()
+        with self._lock:
+            store[key] = (now, value)
+            while len(store) > self.max_packages:
+                store.popitem(last=False)
+        return value
+
+    def package(self, name):
+        """Return a `Package` whose document has been fetched. Raises
+        `PackageError` if it can't be.
+        """
+        def load():
+            package = _WarmPackage(name, **self.package_options)
+            package.body
+            return package.compact()
+        return self._get(self._packages, normalize_name(name), load)
+
+    def search(self, query, n=None, search_fields=('name',)):
+        """Return a list of search results."""
+        def load():
+            searcher = Searcher(search_fields=search_fields,
+                                **self.search_options)
+            return list(searcher.search(query, n=n))
+        key = (tuple(search_fields), query, n)
+        return self._get(self._searches, key, load)
+
+    def status(self):
+        with self._lock:
+            return OrderedDict([
+                ('version', __version__),
+                ('pid', os.getpid()),
+                ('uptime', self.clock() - self.started),
+                ('packages', len(self._packages)),
+                ('searches', len(self._searches)),
+                ('requests', self.stats['requests']),
+                ('hits', self.stats['hits']),
+                ('misses', self.stats['misses']),
+            ])
+
+    def handle(self, path):
+        """Answer a GET request for ``path``.
+
+        :return: A tuple of (HTTP status, body, content type).
+        """
+        if PY2:
+            from urlparse import urlsplit, parse_qs
+        else:
+            from urllib.parse import urlsplit, parse_qs
+        with self._lock:
+            self.stats['requests'] += 1
+        url = urlsplit(path)
+        parts = [part for part in url.path.split('/') if part]
+        params = parse_qs(url.query)
+        try:
+            if len(parts) == 3 and parts[0] == 'pypi' and parts[2] == 'json':
+                return 200, self.package(parts[1]).body, 'application/json'
+            if len(parts) == 2 and parts[0] in ('info', 'stat'):
+                return (200, self.package(parts[1]).record(parts[0]),
+                        'application/json')
+            if parts == ['search'] and params.get('q'):
+                n = int(params['n'][0]) if params.get('n') else None
+                fields = tuple(','.join(params.get('fields', ['name']))
+                               .split(','))
+                result = self.search(params['q'][0], n, fields)
+            elif parts == ['status']:
+                result = self.status()
+            else:
+                return _json_response(404, {'error': 'Not found'})
+        except NotFoundError as error:
+            return _json_response(404, {'error': str(error)})
+        except PackageError as error:
+            return _json_response(502, {'error': str(error)})
+        except ValueError as error:
+            return _json_response(400, {'error': str(error)})
+        return _json_response(200, result)
+
+
+def _json_response(status, value):
+    return status, json.dumps(value).encode('utf-8'), 'application/json'
+
+
+def make_server(package_server, host='127.0.0.1', port=0):
+    """Return a threaded HTTP server that answers GET requests with
+    ``package_server`` (a `PackageServer`). Call ``serve_forever`` to start
+    serving.
+    """
+    if PY2:
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+        from SocketServer import ThreadingMixIn
+    else:
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        from socketserver import ThreadingMixIn
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            status, body, content_type = package_server.handle(self.path)
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    return Server((host, port), Handler)
+
+
+class DaemonClient(object):
+    """Gets package data and search results from a ``pypi serve`` daemon
+    listening at ``url``. Requests that fail return `None`, so that callers
+    can fall back to contacting PyPI, and the daemon isn't asked again.
+
+    :param pypi_url: The index the daemon gets data from.
+    :param ttl: The daemon's ``--ttl``.
+    """
+
+    def __init__(self, url, timeout=DAEMON_TIMEOUT, pypi_url=DEFAULT_PYPI,
+                 ttl=DEFAULT_SERVE_TTL):
+        self.url = url
+        self.timeout = timeout
+        self.pypi_url = pypi_url
+        self.ttl = ttl
+        self.available = True
+
+    @staticmethod
+    def read_state(path):
+        try:
+            with io.open(path, 'rb') as fp:
+                return json.loads(fp.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+
+    @classmethod
+    def discover(cls, cache_dir):
+        """Return a client for the daemon that uses ``cache_dir``, or `None`
+        if it isn't running.
+        """
+        state = cls.read_state(os.path.join(cache_dir, DAEMON_STATE_FILE))
+        if not state or not _pid_exists(state.get('pid')):
+            return None
+        return cls(state['url'], pypi_url=state.get('pypi_url', DEFAULT_PYPI),
+                   ttl=state.get('ttl', DEFAULT_SERVE_TTL))
+
+    def serves(self, pypi_url, max_age=None):
+        """Return whether the daemon can answer for ``pypi_url`` with data
+        no older than ``max_age`` seconds.
+        """
+        return (self.available and pypi_url == self.pypi_url and
+                (max_age is None or max_age >= self.ttl))
+
+    def _get(self, path):
+        """Return the status and body of a GET request to the daemon, or
+        `None` if it can't be reached.
+        """
+        if not self.available:
+            return None
+        if PY2:
+            from httplib import HTTPConnection, HTTPException
+        else:
+            from http.client import HTTPConnection, HTTPException
+        import socket
+        host = self.url.split('://', 1)[-1]
+        conn = HTTPConnection(host, timeout=self.timeout)
+        try:
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+        except (socket.error, HTTPException):
+            self.available = False
+            return None
+        finally:
+            conn.close()
+
+    def get(self, name):
+        """Return a package's JSON document, or `None` if the daemon can't
+        provide it. Raises `NotFoundError` if the package doesn't exist.
+        """
+        response = self._get('/pypi/{0}/json'.format(urlquote(name)))
+        if response is None:
+            return None
+        status, body = response
+        if status == 404:
+            raise NotFoundError('Package not found')
+        return body if status == 200 else None
+
+    def search(self, query, n=None, search_fields=('name',)):
+        """Return a list of search results, or `None` if the daemon can't
+        provide them.
+        """
+        path = '/search?q={0}&fields={1}'.format(
+            urlquote(query), ','.join(search_fields))
+        if n:
+            path += '&n={0:d}'.format(n)
+        response = self._get(path)
+        if response is None or response[0] != 200:
+            return None
+        return json.loads(response[1].decode('utf-8'))
+
+
+def _pid_exists(pid):
+    """Return whether a process with id ``pid`` is running. Always true if
+    this can't be checked.
+    """
+    if not isinstance(pid, int):
+        return False
+    if os.name != 'posix':
+        return True
+    import errno
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+    pypi_cli_async
+    ~~~~~~~~~~~~~~
+
+    asyncio interface to the Python Package Index. Requires Python >= 3.5.
+
+    :copyright: (c) 2014 by Steven Loria.
+    :license: MIT, see LICENSE for more details.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from pypi_cli import DEFAULT_JOBS, Package, Searcher
+
+
+class AsyncPackage(Package):
+    """A `Package` whose data is fetched without blocking the event loop.
+
+    Await `load` before accessing any properties. ::
+
+        package = await AsyncPackage('requests').load()
+        package.max_version
+
+    Requests are sent from ``executor`` (the event loop's default executor
+    if `None`), through the same transport, caches and mirror as `Package`.
+    """
+
+    def __init__(self, name, executor=None, **kwargs):
+        super(AsyncPackage, self).__init__(name, **kwargs)
+        self.executor = executor
+
+    @property
+    def data(self):
+        try:
+            return self._data
+        except AttributeError:
+            raise RuntimeError('AsyncPackage.load() must be awaited before '
+                               'accessing package data')
+
+    async def load(self):
+        """Fetch the package's data, if it hasn't been loaded yet.
+
+        :return: The package.
+        """
+        if not hasattr(self, '_data'):
+            loop = asyncio.get_event_loop()
+            self._data = await loop.run_in_executor(self.executor,
+                                                    self._load)
+        return self
+
+    def __repr__(self):
+        return '<AsyncPackage(name={0!r})>'.format(self.name)
+
+
+class AsyncSearcher(Searcher):
+    """A `Searcher` whose `search` is a coroutine."""
+
+    def __init__(self, executor=None, **kwargs):
+        super(AsyncSearcher, self).__init__(**kwargs)
+        self.executor = executor
+
+    async def search(self, query, n=None, enrich=0):
+        """Search for packages.
+
+        :return: A list of search results, ranked by `score`.
+        """
+        loop = asyncio.get_event_loop()
+        search = super(AsyncSearcher, self).search
+        return await loop.run_in_executor(
+            self.executor, lambda: list(search(query, n=n, enrich=enrich)))
+
+
+async def gather_packages(names, concurrency=DEFAULT_JOBS,
+                          return_exceptions=False, **kwargs):
+    """Load many packages concurrently, fetching at most ``concurrency``
+    at a time.
+
+    :param names: Package names.
+    :param return_exceptions: If `True`, errors (e.g. `NotFoundError`) are
+        returned in place of the corresponding packages rather than raised.
+    :param kwargs: Passed to the `AsyncPackage` constructor.
+    :return: A list of loaded `AsyncPackage` objects, in the order given.
+    """
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    packages = [AsyncPackage(name, executor=executor, **kwargs)
+                for name in names]
+    try:
+        return await asyncio.gather(
+            *[package.load() for package in packages],
+            return_exceptions=return_exceptions)
+    finally:
+        # Waiting for the remaining fetches after an error would block the
+        # event loop
+        executor.shutdown(wait=False)
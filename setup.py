@@ -7,9 +7,14 @@ from setuptools.command.test import test as TestCommand
 REQUIRES = [
     'requests>=2.3.0',
     'python-dateutil>=2.2',
-    'click>=3.0',
+    'click>=7.0',
 ]
 
+PY_MODULES = ['pypi_cli']
+if sys.version_info >= (3, 5):
+    # asyncio interface
+    PY_MODULES.append('pypi_cli_async')
+
 if 'win32' in str(sys.platform).lower():
     # Terminal colors for Windows
     REQUIRES.append('colorama>=0.2.4')
@@ -63,6 +68,8 @@ setup(
     author_email='sloria1@gmail.com',
     url='https://github.com/sloria/pypi-cli',
     install_requires=REQUIRES,
+    extras_require={'streaming': ['ijson>=3.1'],
+                    'markers': ['packaging>=16.0']},
     license=read("LICENSE"),
     zip_safe=False,
     include_package_data=True,
@@ -78,7 +85,7 @@ setup(
         'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: Implementation :: CPython',
     ],
-    py_modules=["pypi_cli"],
+    py_modules=PY_MODULES,
     entry_points={
         'console_scripts': [
             "pypi = pypi_cli:cli"
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import sys
+import subprocess
 import webbrowser
 
 from invoke import task, run
@@ -7,6 +9,52 @@ from invoke import task, run
 def test():
     run('python setup.py test', pty=True)
 
+# Modules that must not be imported when pypi_cli is imported
+LAZY_MODULES = ('requests', 'dateutil', 'xmlrpc.client', 'xmlrpclib')
+
+@task
+def startup(max_ms=100, runs=5):
+    """Check that importing pypi_cli is fast and doesn't import heavy
+    dependencies. Requires Python >= 3.7.
+    """
+    check = ('import sys, pypi_cli; '
+             'print(",".join(m for m in {0!r} if m in sys.modules))'
+             .format(LAZY_MODULES))
+    imported = subprocess.check_output(
+        [sys.executable, '-c', check]).decode('utf-8').strip()
+    if imported:
+        sys.exit('Importing pypi_cli imported: {0}'.format(imported))
+    timings = []
+    for _ in range(int(runs)):
+        result = run('{0} -X importtime -c "import pypi_cli"'.format(
+            sys.executable), hide=True)
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            if line.rstrip().endswith('| pypi_cli'):
+                timings.append(int(line.split('|')[1]) / 1000)
+    if not timings:
+        sys.exit('Could not measure the import time of pypi_cli')
+    best = min(timings)
+    print('Import time: {0:.1f} ms (best of {1})'.format(best, runs))
+    if best > float(max_ms):
+        sys.exit('Import time exceeds {0} ms'.format(max_ms))
+
+@task
+def benchmark(compare=None, save=True):
+    """Run the benchmarks. The results of the suite are saved to
+    benchmarks/results/<commit>.json; use --compare=<commit> to compare
+    with a saved run.
+    """
+    run('python benchmarks/bench_search.py', pty=True)
+    run('python benchmarks/bench_memory.py', pty=True)
+    args = []
+    if compare:
+        args.append('--compare {0}'.format(compare))
+    if not save:
+        args.append('--no-save')
+    run('python benchmarks/bench_suite.py {0}'.format(' '.join(args)),
+        pty=True)
+
 @task
 def clean():
     run("rm -rf build")
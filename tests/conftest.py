@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
+import json
 
 import pytest
 import responses
@@ -9,6 +11,10 @@ import pypi_cli as pypi
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('test_async.py')
+
 @pytest.yield_fixture
 def mock_api():
     """A mock for the PyPI JSON API."""
@@ -50,6 +56,59 @@ def package():
     return pypi.Package('webargs')
 
 
+@pytest.fixture
+def cache(tmpdir):
+    return pypi.ResponseCache(str(tmpdir.join('responses')))
+
+
 @pytest.fixture(scope='function')
-def runner(mock_api):
-    return CliRunner()
+def runner(mock_api, tmpdir):
+    return CliRunner(env={'PYPI_CLI_CACHE_DIR': str(tmpdir)})
+
+
+def make_document(name, version='1.0', requires_dist=None):
+    return json.dumps({'info': {'name': name, 'version': version,
+                                'requires_dist': requires_dist},
+                       'releases': {}})
+
+
+@pytest.yield_fixture
+def dependency_api():
+    """A mock for the PyPI JSON API with a graph of dependencies."""
+    documents = {
+        'app': make_document('app', '2.0', [
+            'lib-a (>=1.0)',
+            'Lib_B[fast] ; python_version >= "3"',
+            'winonly ; sys_platform == "win32"',
+            'testdep ; extra == "test"',
+            'missing',
+        ]),
+        'lib-a': make_document('lib-a', '1.5', ['Lib.B']),
+        'lib-b': make_document('Lib_B', '0.3', ['fastlib ; extra == "fast"',
+                                                'app']),
+        'fastlib': make_document('fastlib'),
+        'winonly': make_document('winonly'),
+        'testdep': make_document('testdep'),
+    }
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as mock:
+        for name, body in documents.items():
+            mock.add(responses.GET, 'https://pypi.python.org/pypi/{0}/json'.format(name),
+                     body=body, content_type='application/json')
+        mock.add(responses.GET, 'https://pypi.python.org/pypi/missing/json', status=404)
+        yield mock
+
+
+
+@pytest.yield_fixture
+def daemon(mock_api):
+    """A `pypi serve` daemon running in a thread."""
+    import threading
+    server = pypi.PackageServer()
+    httpd = pypi.make_server(server)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    server.url = 'http://{0}:{1}'.format(*httpd.server_address[:2])
+    yield server
+    httpd.shutdown()
+    httpd.server_close()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+import pypi_cli as pypi
+from pypi_cli_async import AsyncPackage, AsyncSearcher, gather_packages
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@pytest.mark.usefixtures('mock_api')
+class TestAsyncPackage:
+
+    def test_load(self):
+        package = run(AsyncPackage('webargs').load())
+        sync_package = pypi.Package('webargs')
+        assert package.max_version == sync_package.max_version
+        assert package.version_downloads == sync_package.version_downloads
+        assert package.summary == sync_package.summary
+
+    def test_data_requires_load(self):
+        with pytest.raises(RuntimeError):
+            AsyncPackage('webargs').summary
+
+    def test_not_found(self):
+        with pytest.raises(pypi.NotFoundError):
+            run(AsyncPackage('nope').load())
+
+    def test_gather_packages(self):
+        packages = run(gather_packages(['webargs', 'nope', 'foo'],
+                                       concurrency=2, return_exceptions=True))
+        assert packages[0].name == 'webargs'
+        assert isinstance(packages[1], pypi.NotFoundError)
+        assert packages[2].downloads == 0
+
+    def test_gather_packages_error_does_not_block(self, monkeypatch):
+        import threading
+        import time
+        release = threading.Event()
+
+        def load(self):
+            if self.name == 'nope':
+                raise pypi.NotFoundError('Package not found')
+            release.wait(5)
+            return {}
+        monkeypatch.setattr(AsyncPackage, '_load', load)
+        start = time.time()
+        try:
+            with pytest.raises(pypi.NotFoundError):
+                run(gather_packages(['slow', 'nope'], concurrency=2))
+            assert time.time() - start < 1
+        finally:
+            release.set()
+
+
+class FakeClient(object):
+
+    def search(self, spec, operator):
+        return [{'name': 'foo-webargs', 'summary': None},
+                {'name': 'webargs', 'summary': None}]
+
+
+def test_async_searcher():
+    searcher = AsyncSearcher(client=FakeClient())
+    results = run(searcher.search('webargs', n=1))
+    assert results == [{'name': 'webargs', 'summary': None}]
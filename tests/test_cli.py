@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
+import os
+import csv
+import json
+
 import mock
 import pytest
+from click.testing import CliRunner
 
 import pypi_cli as pypi
 
@@ -21,6 +26,39 @@ class TestStat:
         assert result.exit_code == 0
         assert 'Download statistics for webargs' in result.output
 
+    @mock.patch.object(pypi.Transport, 'allow_concurrency')
+    def test_jobs_raise_concurrency(self, allow_concurrency, runner):
+        result = runner.invoke(pypi.cli, ['stat', '-j', '32', 'webargs'])
+        assert result.exit_code == 0
+        allow_concurrency.assert_called_with(32)
+
+    def test_skips_package_without_releases(self, runner):
+        result = runner.invoke(pypi.cli, ['stat', '-q', 'foo', 'webargs'])
+        assert result.exit_code == 0
+        assert '"foo" has no releases' in result.output
+        assert 'Download statistics for webargs' in result.output
+
+    def test_jsonl(self, runner):
+        result = runner.invoke(pypi.cli, ['stat', '-f', 'jsonl', 'webargs', 'nope', 'webargs'])
+        assert result.exit_code == 0
+        lines = [line for line in result.output.splitlines() if line.startswith('{')]
+        assert len(lines) == 2
+        record = json.loads(lines[0])
+        assert record['name'] == 'webargs'
+        assert record['downloads'] == sum(r['downloads'] for r in record['releases'])
+        assert 'Fetching statistics' not in result.output
+
+    def test_group_by(self, runner):
+        result = runner.invoke(pypi.cli, ['stat', '--group-by', 'quarter', 'webargs'])
+        assert result.exit_code == 0
+        assert 'Downloads by quarter' in result.output
+        assert '2014-Q2' in result.output
+        result = runner.invoke(pypi.cli, ['stat', '-f', 'json', '--group-by', 'minor',
+                                          '--top', '2', 'webargs'])
+        assert result.exit_code == 0
+        groups = json.loads(result.output)[0]['groups']
+        assert [group['group'] for group in groups] == ['0.1', '0.3', 'other']
+
 @pytest.mark.usefixtures('mock_api')
 class TestBrowse:
 
@@ -49,6 +87,54 @@ class TestSearch:
         assert mock_launch.called is True
         mock_launch.assert_called_with('https://pypi.python.org/pypi?%3Aaction=search&term=flask%20marshmallow')
 
+    @mock.patch('pypi_cli.Searcher.client', new_callable=mock.PropertyMock)
+    def test_json(self, mock_client, runner):
+        mock_client.return_value.search.return_value = [
+            {'name': 'webargs', 'summary': 'Parse args', 'version': '0.4.0'}]
+        result = runner.invoke(pypi.cli, ['search', '-f', 'json', 'webargs'])
+        assert result.exit_code == 0, result.output
+        assert json.loads(result.output) == [
+            {'name': 'webargs', 'summary': 'Parse args', 'version': '0.4.0'}]
+
+    @mock.patch('pypi_cli.Searcher.client', new_callable=mock.PropertyMock)
+    def test_summary_and_details(self, mock_client, runner):
+        client = mock_client.return_value
+        client.system.multicall.side_effect = [
+            [[[{'name': 'webargs', 'summary': 'Parse args', 'version': '0.4.0'}]],
+             [[{'name': 'flask-args', 'summary': 'webargs for Flask', 'version': '1.0'}]]],
+            [[{'author': 'Steven Loria', 'license': 'MIT'}]],
+            [[{'author': 'Steven Loria', 'license': 'MIT'}]],
+        ]
+        result = runner.invoke(pypi.cli, ['search', '--summary', '--details', '1', 'webargs'])
+        assert result.exit_code == 0, result.output
+        assert 'flask-args' in result.output
+        assert 'Steven Loria | MIT' in result.output
+        client.search.return_value = [
+            {'name': 'webargs', 'summary': 'Parse args', 'version': '0.4.0'}]
+        result = runner.invoke(pypi.cli, ['search', '-f', 'jsonl', '-d', '1', 'webargs'])
+        assert result.exit_code == 0, result.output
+        record = json.loads(result.output)
+        assert record['author'] == 'Steven Loria'
+        assert record['requires_python'] is None
+
+    def test_local_without_index(self, runner):
+        result = runner.invoke(pypi.cli, ['search', '--local', 'flask'])
+        assert result.exit_code > 0
+        assert 'pypi index build' in result.output
+
+    @mock.patch('pypi_cli.Searcher.client', new_callable=mock.PropertyMock)
+    def test_local(self, mock_client, runner):
+        mock_client.return_value.changelog_last_serial.return_value = 1
+        mock_client.return_value.list_packages.return_value = ['Flask', 'flask-foo']
+        result = runner.invoke(pypi.cli, ['index', 'build'])
+        assert result.exit_code == 0, result.output
+        assert 'Indexed 2 packages' in result.output
+        result = runner.invoke(pypi.cli, ['search', '--local', 'flask'])
+        assert result.exit_code == 0, result.output
+        assert 'Flask' in result.output
+        assert 'flask-foo' in result.output
+        assert mock_client.return_value.search.called is False
+
 @pytest.mark.usefixtures('mock_api')
 class TestInfo:
 
@@ -65,6 +151,192 @@ class TestInfo:
         result = runner.invoke(pypi.cli, ['info', 'https://pypi.python.org/pypi/webargs'])
         assert result.exit_code == 0
 
+    def test_csv(self, runner):
+        result = runner.invoke(pypi.cli, ['info', '-f', 'csv', '-c', 'webargs', 'foo'])
+        assert result.exit_code == 0
+        rows = list(csv.DictReader(result.output.splitlines(True)))
+        assert [row['name'] for row in rows] == ['webargs', 'foo']
+        assert 'Intended Audience :: Developers' in rows[0]['classifiers'].splitlines()
+
+    def test_from_file(self, runner, tmpdir):
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write('# Dependencies\nwebargs==0.4.0\nnope>=1\n')
+        result = runner.invoke(pypi.cli, ['info', 'foo', '-r', str(requirements)])
+        assert result.exit_code == 0
+        assert 'No versions found for "nope"' in result.output
+        assert result.output.index('foo\n===') < result.output.index('webargs\n=======')
+
+    def test_from_stdin(self, runner):
+        result = runner.invoke(pypi.cli, ['stat', '-q', '-'], input='webargs\n')
+        assert result.exit_code == 0
+        assert 'Download statistics for webargs' in result.output
+
+    @pytest.mark.parametrize('jobs', ['1', '4'])
+    def test_multiple_packages_in_order(self, runner, jobs):
+        result = runner.invoke(pypi.cli, ['info', '-j', jobs, 'foo', 'nope', 'webargs'])
+        assert result.exit_code == 0
+        assert 'No versions found for "nope"' in result.output
+        assert result.output.index('foo\n===') < result.output.index('webargs\n=======')
+
+@pytest.mark.usefixtures('mock_api')
+class TestMirror:
+
+    @mock.patch('pypi_cli.Searcher.client', new_callable=mock.PropertyMock)
+    def test_sync_and_use(self, mock_client, runner, tmpdir, mock_api):
+        mock_client.return_value.changelog_last_serial.return_value = 1
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write('webargs>=0.4\n')
+        result = runner.invoke(pypi.cli, ['mirror', 'sync', '-r', str(requirements)])
+        assert result.exit_code == 0, result.output
+        assert 'Updated 1 of 1 packages (serial 1)' in result.output
+        n_calls = len(mock_api.calls)
+        result = runner.invoke(pypi.cli, ['info', 'webargs'])
+        assert result.exit_code == 0
+        assert len(mock_api.calls) == n_calls
+
+    def test_sync_without_packages(self, runner):
+        result = runner.invoke(pypi.cli, ['mirror', 'sync'])
+        assert result.exit_code > 0
+
+@pytest.mark.usefixtures('mock_api')
+class TestOffline:
+
+    def test_offline_uses_cached_packages(self, runner):
+        result = runner.invoke(pypi.cli, ['info', 'webargs'])
+        assert result.exit_code == 0
+        result = runner.invoke(pypi.cli, ['--offline', 'info', 'webargs', 'foo'])
+        assert result.exit_code == 0
+        assert 'webargs\n=======' in result.output
+        assert 'Could not get "foo": Package not available offline' in result.output
+
+    def test_offline_requires_cache(self, runner):
+        result = runner.invoke(pypi.cli, ['--offline', '--no-cache', 'info', 'webargs'])
+        assert result.exit_code > 0
+
+@pytest.mark.usefixtures('mock_api')
+class TestCompare:
+
+    def test_missing_package_arg(self, runner):
+        result = runner.invoke(pypi.cli, ['compare'])
+        assert result.exit_code > 0
+
+    def test_table(self, runner):
+        result = runner.invoke(pypi.cli, ['compare', 'webargs', 'nope', 'foo'])
+        assert result.exit_code == 0, result.output
+        assert 'No versions found for "nope"' in result.output
+        lines = result.output.splitlines()
+        assert lines[1].split()[:4] == ['name', 'releases', 'first_release', 'latest_release']
+        assert lines[2].split()[:2] == ['webargs', '8']
+        assert lines[3].split()[:5] == ['foo', '0', '-', '-', '0']
+
+    def test_json(self, runner):
+        result = runner.invoke(pypi.cli, ['compare', '-f', 'json', '-p', '25', '--sort',
+                                          'downloads', 'foo', 'webargs'])
+        assert result.exit_code == 0, result.output
+        rows = json.loads(result.output)
+        assert [row['name'] for row in rows] == ['webargs', 'foo']
+        assert rows[0]['downloads'] == 7052
+        assert rows[0]['first_release'] == '2014-02-17'
+        assert 'p25' in rows[0] and 'p90' not in rows[0]
+
+
+class TestDeps:
+
+    @pytest.fixture
+    def runner(self, dependency_api, tmpdir):
+        return CliRunner(env={'PYPI_CLI_CACHE_DIR': str(tmpdir)})
+
+    def test_tree(self, runner):
+        result = runner.invoke(pypi.cli, ['deps', '--platform', 'linux', 'app'])
+        assert result.exit_code == 0, result.output
+        assert result.output.splitlines() == [
+            'app 2.0',
+            '|-- lib-a>=1.0 1.5',
+            '|   `-- Lib.B 0.3',
+            '|       |-- fastlib 1.0',
+            '|       `-- app 2.0 (*)',
+            '|-- Lib_B[fast] 0.3 (*)',
+            '`-- missing (Package not found)',
+        ]
+
+    def test_json(self, runner):
+        result = runner.invoke(pypi.cli, ['deps', '-f', 'json', '--depth', '1',
+                                          '--platform', 'win32', '--python', '2.7', 'app'])
+        assert result.exit_code == 0, result.output
+        records = json.loads(result.output)
+        assert [record['name'] for record in records] == ['app', 'lib-a', 'winonly', 'missing']
+        assert records[0]['requires'] == ['lib-a>=1.0', 'winonly', 'missing']
+        assert records[-1]['error'] == 'Package not found'
+
+    def test_not_found(self, runner):
+        result = runner.invoke(pypi.cli, ['deps', 'missing'])
+        assert result.exit_code > 0
+        assert 'No versions of "missing" were found' in result.output
+
+
+class TestServe:
+
+    def test_serve(self, runner, tmpdir):
+        state_path = tmpdir.join(pypi.DAEMON_STATE_FILE)
+        states = []
+
+        def serve_forever():
+            states.append(json.loads(state_path.read()))
+            raise KeyboardInterrupt
+        with mock.patch('pypi_cli.make_server') as make_server:
+            httpd = make_server.return_value
+            httpd.server_address = ('127.0.0.1', 8123)
+            httpd.serve_forever.side_effect = serve_forever
+            result = runner.invoke(pypi.cli, ['serve', '--port', '8123'])
+        assert result.exit_code == 0, result.output
+        assert 'Serving on http://127.0.0.1:8123' in result.output
+        assert make_server.call_args[0][1:] == ('127.0.0.1', 8123)
+        assert states[0]['url'] == 'http://127.0.0.1:8123'
+        assert not state_path.check()
+
+    def test_commands_use_daemon(self, runner, tmpdir, daemon):
+        tmpdir.join(pypi.DAEMON_STATE_FILE).write(
+            json.dumps({'url': daemon.url, 'pid': os.getpid()}))
+        result = runner.invoke(pypi.cli, ['info', 'webargs'])
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(pypi.cli, ['stat', 'webargs', 'nope'])
+        assert result.exit_code == 0, result.output
+        assert 'No versions found for "nope"' in result.output
+        assert daemon.stats['requests'] == 3
+        runner.invoke(pypi.cli, ['--no-daemon', 'info', 'webargs'])
+        runner.invoke(pypi.cli, ['--offline', 'info', 'webargs'])
+        runner.invoke(pypi.cli, ['--no-cache', 'info', 'webargs'])
+        runner.invoke(pypi.cli, ['--max-age', '0', 'info', 'webargs'])
+        assert daemon.stats['requests'] == 3
+
+
+@pytest.mark.usefixtures('mock_api')
+class TestProfile:
+
+    def test_profile(self, runner):
+        result = runner.invoke(pypi.cli, ['--profile', 'stat', 'webargs'])
+        assert result.exit_code == 0
+        assert 'package.parse' in result.output
+        assert 'Requests: 1, retries: 0' in result.output
+
+    def test_profile_output(self, runner, tmpdir):
+        path = str(tmpdir.join('profile.json'))
+        result = runner.invoke(pypi.cli, ['--profile-output', path, '--cprofile',
+                                          str(tmpdir.join('stats')), 'info', 'webargs'])
+        assert result.exit_code == 0
+        assert 'package.parse' not in result.output
+        with open(path) as fp:
+            summary = json.load(fp)
+        assert 'package.fetch' in [phase['phase'] for phase in summary['phases']]
+        assert summary['requests']['requests'] == 1
+        assert tmpdir.join('stats').check()
+
+    def test_trace_envvar(self, runner):
+        result = runner.invoke(pypi.cli, ['stat', 'webargs'], env={'PYPI_CLI_TRACE': '1'})
+        assert result.exit_code == 0
+        assert 'package.parse' in result.output
+
+
 def test_version(runner):
     result = runner.invoke(pypi.cli, ['-v'])
     assert result.output == pypi.__version__ + '\n'
@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+
+import mock
 import pytest
+import requests
+import responses
 
 import pypi_cli as pypi
 
+HERE = os.path.abspath(os.path.dirname(__file__))
+
 
 @pytest.mark.usefixtures('mock_api')
 class TestPackage:
@@ -15,6 +25,19 @@ class TestPackage:
                  '0.3.2', '0.3.3', '0.3.4', '0.4.0']
         assert package.versions == vers
 
+    def test_releases(self, package):
+        release = package.releases[-1]
+        assert release == pypi.Release('0.4.0', '2014-06-05T00:39:25',
+                                       package.version_downloads['0.4.0'], 2)
+        times = [each.upload_time for each in package.releases]
+        assert times == sorted(times)
+
+    def test_release_info_is_deprecated(self, package):
+        with pytest.warns(DeprecationWarning):
+            release_info = package.release_info
+        assert [version for version, _ in release_info] == package.versions
+        assert all(files for _, files in release_info)
+
     def test_downloads(self, package):
         assert package.downloads == sum(package.version_downloads.values())
 
@@ -39,3 +62,822 @@ class TestPackage:
         package = pypi.Package('foo')
         assert package.downloads == 0
         assert package.min_version == (None, 0)
+
+
+@pytest.mark.usefixtures('mock_api')
+class TestResponseCache:
+
+    def test_set_and_get(self, cache):
+        cache.set('key', b'{"a": 1}', etag='"abc"')
+        entry = cache.get('key')
+        assert entry.body == b'{"a": 1}'
+        assert entry.etag == '"abc"'
+        assert entry.last_modified is None
+        assert cache.get('missing') is None
+
+    def test_package_revalidates_cached_document(self, mock_api, cache):
+        url = 'https://pypi.python.org/pypi/cached/json'
+        requests_headers = []
+
+        def callback(request):
+            requests_headers.append(request.headers)
+            if request.headers.get('If-None-Match') == '"v1"':
+                return (304, {}, '')
+            return (200, {'ETag': '"v1"'}, '{"info": {"summary": "Cached"}}')
+        mock_api.add_callback(mock_api.GET, url, callback=callback)
+
+        assert pypi.Package('cached', cache=cache).summary == 'Cached'
+        assert pypi.Package('cached', cache=cache).summary == 'Cached'
+        assert 'If-None-Match' not in requests_headers[0]
+        assert requests_headers[1]['If-None-Match'] == '"v1"'
+
+    def test_touch_updates_fetched_time_only(self, cache):
+        entry = cache.set('key', b'body\n{"x": 1}', etag='"abc"',
+                          fetched=time.time() - 120)
+        path = cache._entry_path('key')
+        size = os.path.getsize(path)
+        with mock.patch.object(pypi, '_atomic_write') as atomic_write:
+            touched = cache.touch('key', entry)
+        assert atomic_write.called is False
+        assert os.path.getsize(path) == size
+        assert cache.fresh('key', max_age=60) == touched
+        assert touched.body == b'body\n{"x": 1}'
+        assert touched.etag == '"abc"'
+
+    def test_touch_rewrites_other_entries(self, cache):
+        path = cache._entry_path('key')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fp:
+            fp.write(b'{"fetched": 0, "etag": null}\nbody')
+        entry = cache.touch('key', cache.get('key'))
+        assert cache.fresh('key', max_age=60) == entry
+        assert entry.body == b'body'
+
+    def test_prune_evicts_old_and_oversized_entries(self, cache):
+        cache.set('old', b'x' * 10)
+        cache.set('new', b'y' * 10)
+        old_path = cache._entry_path('old')
+        stale = time.time() - cache.max_age - 1
+        os.utime(old_path, (stale, stale))
+        cache.prune()
+        assert cache.get('old') is None
+        assert cache.get('new') is not None
+        cache.max_size = 0
+        cache.prune()
+        assert cache.get('new') is None
+
+    def test_max_age_serves_cache_without_request(self, cache):
+        cache.set('https://pypi.python.org/pypi/unregistered/json',
+                  b'{"info": {"summary": "Fresh"}}')
+        package = pypi.Package('unregistered', cache=cache, max_age=60)
+        assert package.summary == 'Fresh'
+
+    def test_offline_raises_if_not_cached(self, cache):
+        package = pypi.Package('webargs', cache=cache, offline=True)
+        with pytest.raises(pypi.OfflineError):
+            package.data
+
+    def test_offline_respects_max_age(self, cache):
+        url = 'https://pypi.python.org/pypi/webargs/json'
+        cache.set(url, b'{"info": {}}', fetched=time.time() - 120)
+        assert pypi.Package('webargs', cache=cache, offline=True).data
+        package = pypi.Package('webargs', cache=cache, offline=True,
+                               max_age=60)
+        with pytest.raises(pypi.OfflineError):
+            package.data
+
+
+class TestSearcher:
+
+    def test_rank(self):
+        searcher = pypi.Searcher(client=mock.Mock())
+        results = [
+            {'name': 'flask-foo', 'summary': 'Flask extension'},
+            {'name': 'Flask', 'summary': 'A microframework'},
+            {'name': 'flask-foo', 'summary': 'Flask extension'},
+            {'name': 'bar-flask', 'summary': None},
+        ]
+        ranked = searcher.rank(['flask'], results)
+        assert [r['name'] for r in ranked] == ['Flask', 'flask-foo', 'bar-flask']
+        top = searcher.rank(['flask'], results, n=2)
+        assert [r['name'] for r in top] == ['Flask', 'flask-foo']
+
+    def test_score_escapes_tokens(self):
+        searcher = pypi.Searcher(client=mock.Mock())
+        record = {'name': 'c++-tools', 'summary': 'Tools for C++ and c'}
+        assert searcher.score(['c++'], record) == (
+            searcher.CONTAINS_NAME_MULT + searcher.NAME_IN_SUMMARY_MULT)
+
+    def test_offline_search_uses_cached_results(self, cache):
+        client = mock.Mock()
+        client.search.return_value = [{'name': 'webargs', 'summary': None}]
+        results = pypi.Searcher(client=client, cache=cache).search('webargs')
+        assert [r['name'] for r in results] == ['webargs']
+
+        offline_client = mock.Mock()
+        searcher = pypi.Searcher(client=offline_client, cache=cache,
+                                 offline=True)
+        assert [r['name'] for r in searcher.search('webargs')] == ['webargs']
+        assert offline_client.search.called is False
+        with pytest.raises(pypi.OfflineError):
+            list(searcher.search('flask'))
+
+    def multicall_response(self, *results):
+        """Return the body of a response to system.multicall. Exceptions
+        in ``results`` are returned as faults.
+        """
+        from xmlrpc.client import dumps
+        values = [{'faultCode': 1, 'faultString': str(result)}
+                  if isinstance(result, Exception) else [result]
+                  for result in results]
+        return dumps((values,), methodresponse=True)
+
+    @pytest.mark.skipif(sys.version_info < (3,), reason='xmlrpc.client')
+    def test_search_fields_in_one_request(self):
+        body = self.multicall_response(
+            [{'name': 'flask-oauth', 'summary': 'OAuth', 'version': '1.0'}],
+            [{'name': 'authlib', 'summary': 'Flask OAuth', 'version': '2.0'},
+             {'name': 'flask-oauth', 'summary': 'OAuth', 'version': '1.0'}])
+        with responses.RequestsMock() as mock_http:
+            mock_http.add(responses.POST, pypi.DEFAULT_PYPI, body=body,
+                          content_type='text/xml')
+            searcher = pypi.Searcher(transport=pypi.Transport(),
+                                     search_fields=('name', 'summary'))
+            results = list(searcher.search('flask oauth'))
+            assert len(mock_http.calls) == 1
+            assert b'system.multicall' in mock_http.calls[0].request.body
+        assert [r['name'] for r in results] == ['flask-oauth', 'authlib']
+
+    @pytest.mark.skipif(sys.version_info < (3,), reason='xmlrpc.client')
+    def test_enrich(self):
+        results = [{'name': 'a', 'summary': None, 'version': '1.0'},
+                   {'name': 'b', 'summary': None, 'version': '2.0'},
+                   {'name': 'c', 'summary': None, 'version': None},
+                   {'name': 'd', 'summary': None, 'version': '3.0'}]
+        body = self.multicall_response(
+            {'author': 'Ann', 'license': 'MIT', 'home_page': 'https://a'},
+            ValueError('No such release'))
+        with responses.RequestsMock() as mock_http:
+            mock_http.add(responses.POST, pypi.DEFAULT_PYPI, body=body,
+                          content_type='text/xml')
+            searcher = pypi.Searcher(transport=pypi.Transport())
+            assert searcher.enrich(results, n=3) is results
+            assert len(mock_http.calls) == 1
+        assert results[0]['author'] == 'Ann'
+        assert results[0]['requires_python'] is None
+        assert 'author' not in results[1]
+        assert 'author' not in results[3]
+
+    @pytest.mark.skipif(sys.version_info < (3,), reason='xmlrpc.client')
+    @pytest.mark.parametrize('response', [
+        {'status': 500},
+        {'body': '<?xml version="1.0"?><methodResponse><fault><value><struct>'
+                 '<member><name>faultCode</name><value><int>1</int></value>'
+                 '</member><member><name>faultString</name><value><string>'
+                 'No multicall</string></value></member></struct></value>'
+                 '</fault></methodResponse>'},
+    ])
+    def test_enrich_failure(self, response):
+        results = [{'name': 'a', 'summary': None, 'version': '1.0'}]
+        with responses.RequestsMock() as mock_http:
+            mock_http.add(responses.POST, pypi.DEFAULT_PYPI,
+                          content_type='text/xml', **response)
+            searcher = pypi.Searcher(
+                transport=pypi.Transport(scheduler=pypi.Scheduler(retries=0)))
+            assert searcher.enrich(results) is results
+        assert results == [{'name': 'a', 'summary': None, 'version': '1.0'}]
+
+    def test_enrich_offline(self):
+        client = mock.Mock()
+        results = [{'name': 'a', 'summary': None, 'version': '1.0'}]
+        pypi.Searcher(client=client, offline=True).enrich(results)
+        assert not client.mock_calls
+
+
+@pytest.fixture(params=['ijson', 'json'])
+def parser(request, monkeypatch):
+    if request.param == 'ijson':
+        pytest.importorskip('ijson')
+    else:
+        # Make importing ijson fail
+        monkeypatch.setitem(sys.modules, 'ijson', None)
+    return request.param
+
+
+class TestReleaseTable:
+
+    def test_from_releases(self):
+        table = pypi.ReleaseTable.from_releases({
+            '1.0': [{'upload_time': '2015-01-02T03:04:05', 'downloads': 3},
+                    {'upload_time': '2015-01-01T00:00:00.5', 'downloads': 4}],
+            '0.9': [{'upload_time': '2014-12-31T23:59:59', 'downloads': 1}],
+            '0.8': [],
+        })
+        assert len(table) == 2
+        assert list(table) == [
+            pypi.Release('0.9', '2014-12-31T23:59:59', 1, 1),
+            pypi.Release('1.0', '2015-01-01T00:00:00.500000', 7, 2),
+        ]
+        assert table[-1].version == '1.0'
+        assert table.timestamps[0] == 1420070399
+
+    def test_slots(self):
+        assert not hasattr(pypi.ReleaseTable(), '__dict__')
+
+    def test_timestamps(self):
+        dt = pypi.datetime(2014, 6, 5, 0, 39, 25, 120000)
+        assert pypi.from_timestamp(pypi.to_timestamp(dt)) == dt
+
+    @pytest.mark.usefixtures('mock_api')
+    def test_compact(self, package):
+        releases, downloads = list(package.releases), package.downloads_last_day
+        assert package.compact() is package
+        assert list(package.data) == ['info']
+        assert list(package.releases) == releases
+        assert package.downloads_last_day == downloads
+
+
+@pytest.mark.parametrize('values, q, expected', [
+    ([], 50, None),
+    ([5], 90, 5),
+    ([1, 2, 3, 4], 50, 2.5),
+    ([1, 2, 3, 4], 0, 1),
+    ([1, 2, 3, 4], 100, 4),
+    ([10, 20, 30, 40, 50], 90, 46),
+])
+def test_percentile(values, q, expected):
+    assert pypi.percentile(values, q) == expected
+
+
+class TestDownloadTable:
+
+    def test_summary(self):
+        day = 86400
+        table = pypi.DownloadTable()
+        table.add('a', pypi.ReleaseTable(['1', '2', '3'], [0, 10 * day, 30 * day],
+                                         [30, 10, 20], [1, 1, 1]))
+        table.add('empty', pypi.ReleaseTable())
+        table.add('b', pypi.ReleaseTable(['1'], [day], [7], [1]))
+        assert len(table) == 3
+        a, empty, b = table.summary(percentiles=(0, 90), now=40 * day)
+        assert a == {'name': 'a', 'releases': 3, 'first_release': '1970-01-01',
+                     'latest_release': '1970-01-31', 'downloads': 60,
+                     'median': 20, 'p0': 10, 'p90': 28, 'per_day': 1.5,
+                     'interval_days': 15}
+        assert list(a) == list(pypi.compare_fields((0, 90)))
+        assert empty['releases'] == 0
+        assert empty['median'] is None and empty['per_day'] is None
+        assert b['interval_days'] is None
+        assert b['per_day'] == 7 / 39
+
+
+class TestProfiler:
+
+    def test_profile_without_profiler(self):
+        with pypi.profile('phase') as phase:
+            phase.bytes = 10
+        assert pypi._profiler is None
+
+    def test_phases(self):
+        now = [0.0]
+        profiler = pypi.Profiler(clock=lambda: now[0]).start()
+        try:
+            for seconds in (1, 3):
+                with pypi.profile('http') as phase:
+                    now[0] += seconds
+                    phase.bytes = 100
+            profiler.add('parse', 0.5)
+        finally:
+            profiler.stop()
+        assert pypi._profiler is None
+        summary = profiler.summary({'requests': 2})
+        assert summary['phases'][0] == {'phase': 'http', 'calls': 2,
+                                        'total_ms': 4000, 'mean_ms': 2000,
+                                        'max_ms': 3000, 'bytes': 200}
+        assert summary['phases'][1]['phase'] == 'parse'
+        assert summary['elapsed_ms'] == 4000
+        assert summary['requests'] == {'requests': 2}
+
+    @pytest.mark.usefixtures('mock_api')
+    def test_package_phases(self, package):
+        profiler = pypi.Profiler().start()
+        try:
+            package.chart()
+        finally:
+            profiler.stop()
+        phases = [phase['phase'] for phase in profiler.summary()['phases']]
+        assert phases == ['http', 'http.wait', 'package.fetch',
+                          'package.parse', 'package.releases', 'package.chart']
+        assert profiler.phases['package.fetch'][3] == len(package.fetch())
+
+
+class TestLoadPackageData:
+
+    def read_response(self):
+        with open(os.path.join(HERE, 'response.json'), 'rb') as fp:
+            return fp.read()
+
+    def test_all_fields(self):
+        body = self.read_response()
+        assert pypi.load_package_data(body) == json.loads(body.decode('utf-8'))
+
+    def test_only_info(self, parser):
+        data = pypi.load_package_data(self.read_response(), ('info',))
+        assert list(data) == ['info']
+        assert data['info']['name'] == 'webargs'
+
+    def test_slims_release_files(self, parser):
+        data = pypi.load_package_data(self.read_response(),
+                                      ('info', 'releases'))
+        assert sorted(data) == ['info', 'releases']
+        assert data['releases']['0.4.0'][1] == {
+            'upload_time': '2014-06-05T00:39:25', 'downloads': 156}
+
+    def test_package_stats_with_fields(self, mock_api):
+        full = pypi.Package('webargs')
+        slim = pypi.Package('webargs', fields=('info', 'releases'))
+        assert slim.releases == full.releases
+        assert slim.summary == full.summary
+
+
+@pytest.fixture
+def xmlrpc_client():
+    client = mock.Mock()
+    client.changelog_last_serial.return_value = 10
+    client.list_packages.return_value = ['Flask', 'flask_foo', 'bar-flask',
+                                         'flaskfoo', 'requests']
+    client.changelog_since_serial.return_value = [
+        ('flask-new', None, 0, 'create', 11),
+        ('flaskfoo', None, 0, 'remove project', 12),
+        ('requests', '2.0', 0, 'new release', 13),
+        ('Flask', '0.1', 0, 'remove release', 14),
+    ]
+    return client
+
+
+class TestPackageIndex:
+
+    @pytest.fixture
+    def index(self, tmpdir, xmlrpc_client):
+        index = pypi.PackageIndex(str(tmpdir.join('index.sqlite')))
+        index.build(xmlrpc_client)
+        return index
+
+    def test_build(self, index):
+        assert index.exists()
+        assert index.serial == 10
+
+    def test_search_ranks_like_searcher(self, index, xmlrpc_client):
+        searcher = pypi.Searcher(client=xmlrpc_client)
+        names = xmlrpc_client.list_packages.return_value
+        for tokens in (['flask'], ['flask', 'foo'], ['k_f'], ['k%f']):
+            results = [{'name': name, 'summary': None} for name in names
+                       if all(token in name.lower() for token in tokens)]
+            expected = searcher.rank(tokens, results)
+            assert index.search(tokens) == expected
+            assert index.search(tokens, n=2) == expected[:2]
+
+    def test_update(self, index, xmlrpc_client):
+        # The changelog is returned in two parts
+        changes = xmlrpc_client.changelog_since_serial.return_value
+        xmlrpc_client.changelog_since_serial.side_effect = [
+            changes[:2], changes[2:]]
+        xmlrpc_client.changelog_last_serial.return_value = 14
+        assert index.update(xmlrpc_client) == 4
+        assert index.serial == 14
+        assert [c[0][0] for c in
+                xmlrpc_client.changelog_since_serial.call_args_list] == [10, 12]
+        names = [result['name'] for result in index.search(['flask'])]
+        assert 'flask-new' in names
+        assert 'Flask' in names
+        assert 'flaskfoo' not in names
+
+    def test_searcher_uses_index(self, index):
+        client = mock.Mock()
+        searcher = pypi.Searcher(client=client, index=index)
+        results = list(searcher.search('flask', n=1))
+        assert results == [{'name': 'Flask', 'summary': None}]
+        assert client.search.called is False
+
+
+@pytest.mark.usefixtures('mock_api')
+class TestMirror:
+
+    @pytest.fixture
+    def mirror(self, tmpdir):
+        return pypi.Mirror(str(tmpdir.join('mirror')))
+
+    def test_sync(self, mirror, mock_api, xmlrpc_client):
+        xmlrpc_client.changelog_since_serial.return_value = []
+        updated, missing = mirror.sync(['webargs', 'nope'], xmlrpc_client)
+        assert updated == ['webargs']
+        assert missing == ['nope']
+        assert mirror.serial == 10
+        assert mirror.packages == ['webargs']
+        assert mirror.get('WebArgs') is not None
+        assert xmlrpc_client.changelog_since_serial.called is False
+
+        # Nothing changed
+        n_calls = len(mock_api.calls)
+        assert pypi.Mirror(mirror.path).sync(None, xmlrpc_client) == ([], [])
+        assert xmlrpc_client.changelog_since_serial.called is False
+        assert len(mock_api.calls) == n_calls
+
+        # Package changed; the changelog is returned in two parts
+        xmlrpc_client.changelog_last_serial.return_value = 13
+        xmlrpc_client.changelog_since_serial.side_effect = [
+            [('other', '1.0', 0, 'new release', 11)],
+            [('webargs', '0.5.0', 0, 'new release', 13)],
+        ]
+        mirror = pypi.Mirror(mirror.path)
+        updated, _ = mirror.sync(None, xmlrpc_client)
+        assert updated == ['webargs']
+        assert mirror.serial == 13
+        assert [c[0][0] for c in
+                xmlrpc_client.changelog_since_serial.call_args_list] == [10, 11]
+
+    def test_sync_removes_dropped_packages(self, mirror, xmlrpc_client):
+        mirror.sync(['webargs'], xmlrpc_client)
+        assert mirror.get('webargs') is not None
+        mirror.sync([], xmlrpc_client)
+        assert mirror.packages == []
+        assert mirror.get('webargs') is None
+        assert not os.path.exists(mirror._document_path('webargs'))
+
+    def test_package_reads_from_mirror(self, mirror, xmlrpc_client):
+        mirror.sync(['webargs'], xmlrpc_client)
+        client = mock.Mock()
+        package = pypi.Package('webargs', client=client, mirror=mirror)
+        assert package.summary
+        assert client.get.called is False
+
+    def test_package_ignores_mirror_of_other_index(self, mirror,
+                                                   xmlrpc_client):
+        mirror.sync(['webargs'], xmlrpc_client)
+        client = mock.Mock()
+        client.get.return_value = mock.Mock(status_code=404)
+        package = pypi.Package('webargs', client=client, mirror=mirror,
+                               pypi_url='https://example.com/pypi')
+        with pytest.raises(pypi.NotFoundError):
+            package.fetch()
+        client.get.assert_called_with(
+            'https://example.com/pypi/webargs/json', headers={})
+
+
+def test_parse_requirements():
+    lines = [
+        '# Comment',
+        '',
+        'Flask>=0.10  # web',
+        'requests[security] == 2.8.1',
+        'python-dateutil',
+        "pywin32; sys_platform == 'win32'",
+        '-r other.txt',
+        '--index-url https://example.com',
+        '-e git+https://github.com/sloria/webargs.git#egg=webargs',
+        'zope.interface~=4.1',
+    ]
+    assert list(pypi.parse_requirements(lines)) == [
+        'Flask', 'requests', 'python-dateutil', 'pywin32', 'zope.interface']
+
+
+class TestTransport:
+
+    def test_get_uses_default_timeout(self):
+        transport = pypi.Transport(timeout=3)
+        transport._session = mock.Mock()
+        transport.get('https://example.com')
+        transport._session.request.assert_called_with(
+            'GET', 'https://example.com', timeout=3)
+
+    def test_session_is_reused(self):
+        transport = pypi.Transport(pool_size=2)
+        session = transport.session
+        assert transport.session is session
+        assert session.get_adapter('https://pypi.python.org')._pool_maxsize == 2
+        assert 'gzip' in session.headers['Accept-Encoding']
+
+    def test_allow_concurrency(self):
+        transport = pypi.Transport(pool_size=8)
+        transport.allow_concurrency(32)
+        assert transport.scheduler.max_per_host == 32
+        assert transport.session.get_adapter(
+            'https://pypi.python.org')._pool_maxsize == 32
+        transport.allow_concurrency(4)
+        assert transport.pool_size == 32
+
+    def test_session_is_created_once_across_threads(self):
+        import threading
+        transport = pypi.Transport()
+        calls = []
+
+        def make_session():
+            calls.append(1)
+            time.sleep(0.05)
+            return mock.Mock()
+        transport._make_session = make_session
+        sessions = []
+        threads = [threading.Thread(
+            target=lambda: sessions.append(transport.session))
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert len(set(map(id, sessions))) == 1
+
+    def test_server_proxy(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST, 'https://pypi.python.org/pypi',
+                body=('<?xml version="1.0"?><methodResponse><params><param>'
+                      '<value><int>42</int></value>'
+                      '</param></params></methodResponse>'),
+                content_type='text/xml')
+            client = pypi.Transport().server_proxy(pypi.DEFAULT_PYPI)
+            assert client.changelog_last_serial() == 42
+            assert b'changelog_last_serial' in rsps.calls[0].request.body
+
+
+class TestScheduler:
+
+    def response(self, status_code, headers=None):
+        return mock.Mock(status_code=status_code, headers=headers or {})
+
+    def test_retries_with_backoff(self):
+        sleeps = []
+        scheduler = pypi.Scheduler(retries=3, sleep=sleeps.append)
+        send = mock.Mock(side_effect=[self.response(503),
+                                      self.response(429, {'Retry-After': '2'}),
+                                      self.response(200)])
+        assert scheduler.run('pypi.python.org', send).status_code == 200
+        assert send.call_count == 3
+        assert 0 <= sleeps[0] <= pypi.DEFAULT_BACKOFF
+        assert sleeps[1] == 2
+        assert scheduler.stats['requests'] == 3
+        assert scheduler.stats['retries'] == 2
+
+    def test_gives_up_after_retries(self):
+        scheduler = pypi.Scheduler(retries=1, sleep=lambda _: None)
+        send = mock.Mock(return_value=self.response(503))
+        assert scheduler.run('pypi.python.org', send).status_code == 503
+        assert send.call_count == 2
+
+    def test_retries_connection_errors(self):
+        scheduler = pypi.Scheduler(retries=1, sleep=lambda _: None)
+        send = mock.Mock(side_effect=requests.ConnectionError)
+        with pytest.raises(requests.ConnectionError):
+            scheduler.run('pypi.python.org', send)
+        assert send.call_count == 2
+
+    def test_rate_limit(self):
+        sleeps = []
+        scheduler = pypi.Scheduler(rate=10, burst=2, sleep=sleeps.append)
+        send = mock.Mock(return_value=self.response(200))
+        for _ in range(4):
+            scheduler.run('pypi.python.org', send)
+        assert len(sleeps) == 2
+        assert scheduler.stats['throttled'] == 2
+        assert 0 < sleeps[-1] <= 0.2
+
+    def test_parse_retry_after(self):
+        assert pypi.parse_retry_after('120') == 120
+        assert pypi.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+        assert pypi.parse_retry_after('soon') is None
+        assert pypi.parse_retry_after(None) is None
+
+    def test_package_error_after_retries(self, mock_api):
+        mock_api.add(mock_api.GET, 'https://pypi.python.org/pypi/broken/json',
+                     status=503)
+        scheduler = pypi.Scheduler(retries=2, sleep=lambda _: None)
+        transport = pypi.Transport(scheduler=scheduler)
+        package = pypi.Package('broken', client=transport)
+        with pytest.raises(pypi.RequestError):
+            package.data
+        assert scheduler.stats['retries'] == 2
+
+
+@pytest.mark.usefixtures('mock_api')
+class TestChart:
+
+    def test_chart(self, package):
+        lines = package.chart().splitlines()
+        assert len(lines) == len(package.versions)
+        assert '0.1.0' in lines[0]
+        assert '14/02/17' in lines[0]
+        assert '1,214' in lines[0]
+
+    def test_max_bars(self, package):
+        lines = package.chart(max_bars=3).splitlines()
+        assert len(lines) == 3
+        assert '0.1.0..0.3.0' in lines[0]
+        assert '{0:,}'.format(sum(list(package.version_downloads.values())[:3])) in lines[0]
+        assert len(package.chart(max_bars=100).splitlines()) == len(package.versions)
+
+    def test_range_labels_keep_dates(self, package):
+        lines = package.chart(group_by='month', max_bars=2).splitlines()
+        assert '2014-02..2014-03' in lines[0]
+        assert '14/02/17' in lines[0]
+
+    def test_group_by(self, package):
+        lines = package.chart(group_by='minor').splitlines()
+        assert len(lines) == 4
+        assert '0.3' in lines[2]
+
+
+@pytest.mark.usefixtures('mock_api')
+class TestGroupReleases:
+
+    def test_no_grouping(self, package):
+        releases = package.releases
+        assert package.group_releases() == [
+            pypi.ReleaseGroup(version, timestamp, downloads, 1)
+            for version, timestamp, downloads in zip(
+                releases.versions, releases.timestamps, releases.downloads)]
+
+    def test_by_minor(self, package):
+        groups = package.group_releases('minor')
+        assert [group.name for group in groups] == ['0.1', '0.2', '0.3', '0.4']
+        assert groups[2].releases == 5
+        assert (pypi.from_timestamp(groups[2].timestamp).isoformat() ==
+                '2014-03-02T15:57:32')
+        assert sum(group.downloads for group in groups) == package.downloads
+
+    def test_by_major(self, package):
+        groups = package.group_releases('major')
+        assert len(groups) == 1
+        assert groups[0] == ('0', package.releases.timestamps[0],
+                             package.downloads, 8)
+
+    def test_by_month_and_quarter(self, package):
+        months = package.group_releases('month')
+        assert [group.name for group in months] == [
+            '2014-02', '2014-03', '2014-04', '2014-06']
+        quarters = package.group_releases('quarter')
+        assert [(group.name, group.releases) for group in quarters] == [
+            ('2014-Q1', 6), ('2014-Q2', 2)]
+
+    def test_top(self, package):
+        groups = package.group_releases(top=2)
+        assert [group.name for group in groups] == ['0.1.0', '0.2.0', 'other']
+        assert groups[-1].releases == 6
+        assert sum(group.downloads for group in groups) == package.downloads
+        assert len(package.group_releases('minor', top=10)) == 4
+
+    @pytest.mark.parametrize('version, expected', [
+        ('1.2.3', '1.2'),
+        ('v2.0rc1', '2.0'),
+        ('1!3.4', '3.4'),
+        ('7', '7'),
+        ('dev-snapshot', 'unversioned'),
+    ])
+    def test_version_keys(self, version, expected):
+        package = pypi.Package('foo')
+        package._lazy_releases = pypi.ReleaseTable([version], [0], [1], [1])
+        assert package.group_releases('minor')[0].name == expected
+
+    def test_unversioned_and_other_are_distinct(self):
+        package = pypi.Package('foo')
+        package._lazy_releases = pypi.ReleaseTable(
+            ['1.0', 'nightly', '2.0', '3.0'], [0, 1, 2, 3], [5, 4, 3, 1],
+            [1, 1, 1, 1])
+        groups = package.group_releases('major', top=2)
+        assert [(group.name, group.downloads) for group in groups] == [
+            ('1', 5), ('unversioned', 4), ('other', 4)]
+
+    def test_invalid(self, package):
+        with pytest.raises(ValueError):
+            package.group_releases('day')
+
+
+class TestDependencies:
+
+    @pytest.mark.parametrize('value, expected', [
+        ('requests', ('requests', (), '', None)),
+        ('requests (>=2.0, <3)', ('requests', (), '>=2.0,<3', None)),
+        ('requests[socks,Security] >=2.0 ; extra == "http"',
+         ('requests', ('socks', 'security'), '>=2.0', 'extra == "http"')),
+    ])
+    def test_parse_requires_dist(self, value, expected):
+        assert pypi.parse_requires_dist(value) == expected
+
+    def test_marker_applies(self):
+        assert pypi.marker_applies(None)
+        assert pypi.marker_applies('sys_platform == "win32"', {'sys_platform': 'win32'})
+        assert not pypi.marker_applies('sys_platform == "win32"', {'sys_platform': 'linux'})
+        assert not pypi.marker_applies('extra == "test"')
+        assert pypi.marker_applies('extra == "test"', extras=('test',))
+
+    def test_marker_applies_without_packaging(self):
+        with mock.patch.dict(sys.modules, {'packaging.markers': None}):
+            assert pypi.marker_applies('sys_platform == "win32"')
+            assert not pypi.marker_applies('extra == "test"')
+            assert pypi.marker_applies("extra == 'Test'", extras=('test',))
+
+    def test_dependencies(self, dependency_api):
+        nodes = pypi.Package('app').dependencies(environment={'sys_platform': 'linux'})
+        assert list(nodes) == ['app', 'lib-a', 'lib-b', 'missing', 'fastlib']
+        assert nodes['lib-b'].name == 'Lib_B'
+        assert nodes['lib-b'].depth == 1
+        assert [req.name for req in nodes['lib-b'].requirements] == ['fastlib', 'app']
+        assert isinstance(nodes['missing'].error, pypi.NotFoundError)
+        # Each package is fetched once
+        urls = [call.request.url for call in dependency_api.calls]
+        assert len(urls) == len(set(urls)) == 5
+
+    def test_depth_and_extras(self, dependency_api):
+        nodes = pypi.Package('app').dependencies(
+            depth=1, environment={'sys_platform': 'win32'}, extras=('test',))
+        assert list(nodes) == ['app', 'lib-a', 'lib-b', 'winonly', 'testdep', 'missing']
+        assert nodes['lib-b'].requirements == []
+
+
+@pytest.mark.usefixtures('mock_api')
+class TestPackageServer:
+
+    def test_routes(self):
+        client = mock.Mock()
+        client.search.return_value = [{'name': 'webargs', 'summary': None}]
+        server = pypi.PackageServer(search_options={'client': client})
+        status, body, content_type = server.handle('/pypi/webargs/json')
+        assert status == 200
+        assert json.loads(body.decode('utf-8'))['info']['name'] == 'webargs'
+        assert content_type == 'application/json'
+        status, body, _ = server.handle('/info/webargs')
+        assert json.loads(body.decode('utf-8'))['version'] == '0.4.0'
+        status, body, _ = server.handle('/stat/webargs')
+        assert len(json.loads(body.decode('utf-8'))['releases']) == 8
+        status, body, _ = server.handle('/search?q=webargs&n=5')
+        assert json.loads(body.decode('utf-8')) == [{'name': 'webargs', 'summary': None}]
+        assert server.handle('/info/nope')[0] == 404
+        assert server.handle('/search?q=webargs&n=x')[0] == 400
+        assert server.handle('/unknown')[0] == 404
+        status, body, _ = server.handle('/status')
+        assert json.loads(body.decode('utf-8'))['packages'] == 1
+        # The package was fetched once
+        assert server.stats['misses'] == 3
+        assert server.stats['requests'] == 8
+
+    def test_keeps_compact_packages(self):
+        server = pypi.PackageServer()
+        package = server.package('webargs')
+        assert list(package.data) == ['info']
+        assert json.loads(package.record('stat').decode('utf-8'))[
+            'downloads'] == 7052
+        assert json.loads(package.body.decode('utf-8'))['releases']
+
+    def test_ttl_and_eviction(self):
+        now = [0]
+        server = pypi.PackageServer(ttl=10, max_packages=1, clock=lambda: now[0])
+        package = server.package('webargs')
+        assert server.package('WebArgs') is package
+        now[0] = 10
+        assert server.package('webargs') is not package
+        server.package('foo')
+        assert list(server._packages) == ['foo']
+
+
+class TestDaemonClient:
+
+    def test_get_and_search(self, daemon):
+        client = pypi.DaemonClient(daemon.url)
+        body = client.get('webargs')
+        assert json.loads(body.decode('utf-8'))['info']['name'] == 'webargs'
+        with pytest.raises(pypi.NotFoundError):
+            client.get('nope')
+        package = pypi.Package('webargs', daemon=client)
+        assert package.downloads == pypi.Package('webargs').downloads
+        assert daemon.stats['misses'] == 2
+
+    def test_skipped_for_other_index_or_fresher_data(self, daemon):
+        client = pypi.DaemonClient(daemon.url, ttl=60)
+        assert client.serves(pypi.DEFAULT_PYPI)
+        assert client.serves(pypi.DEFAULT_PYPI, max_age=60)
+        assert not client.serves(pypi.DEFAULT_PYPI, max_age=0)
+        assert not client.serves('https://example.com/pypi')
+        pypi.Package('webargs', daemon=client, max_age=0).data
+        pypi.Searcher(daemon=client, max_age=0,
+                      client=mock.Mock(**{'search.return_value': []})
+                      ).search('webargs')
+        assert daemon.stats['requests'] == 0
+
+    def test_unavailable(self):
+        client = pypi.DaemonClient('http://127.0.0.1:1', timeout=0.5)
+        assert client.get('webargs') is None
+        assert client.available is False
+        assert client.search('webargs') is None
+
+    def test_discover(self, tmpdir):
+        assert pypi.DaemonClient.discover(str(tmpdir)) is None
+        state = tmpdir.join(pypi.DAEMON_STATE_FILE)
+        state.write(json.dumps({'url': 'http://127.0.0.1:8000', 'pid': os.getpid()}))
+        assert pypi.DaemonClient.discover(str(tmpdir)).url == 'http://127.0.0.1:8000'
+        state.write(json.dumps({'url': 'http://127.0.0.1:8000',
+                                'pid': os.getpid(), 'ttl': 10,
+                                'pypi_url': 'https://example.com/pypi'}))
+        client = pypi.DaemonClient.discover(str(tmpdir))
+        assert client.ttl == 10
+        assert client.pypi_url == 'https://example.com/pypi'
+        state.write(json.dumps({'url': 'http://127.0.0.1:8000', 'pid': 2 ** 22 + 1}))
+        assert pypi.DaemonClient.discover(str(tmpdir)) is None
@@ -1,6 +1,74 @@
 # -*- coding: utf-8 -*-
+import sys
+import subprocess
+from datetime import datetime
+
+import mock
+
 import pypi_cli as pypi
 
 
 def test_no_division_by_zero_in_bargraph():
     assert pypi.TICK not in pypi.bargraph({'foo': 0})
+
+
+def test_bargraph_with_pairs():
+    graph = pypi.bargraph([('foo', 1), ('bar', 2)])
+    foo, bar = graph.splitlines()
+    assert foo.startswith('foo')
+    assert bar.count(pypi.TICK) > foo.count(pypi.TICK) > 0
+
+
+@mock.patch('pypi_cli.get_terminal_size', return_value=(80, 24))
+def test_bargraph_longest_bar_fills_width(get_terminal_size):
+    values = [409, 761, 2577, 2964, 1214, 495]
+    graph = pypi.bargraph([(str(i), value) for i, value in enumerate(values)])
+    max_val_length = len(pypi.style(u'{0:,}'.format(2964), fg='yellow'))
+    max_bar_width = 80 - pypi.MARGIN - (1 + 3 + max_val_length + 3)
+    assert graph.splitlines()[3].count(pypi.TICK) == max_bar_width
+
+
+@mock.patch('pypi_cli.get_terminal_size', return_value=(60, 24))
+def test_format_results(get_terminal_size):
+    results = [{'name': 'pkg{0}'.format(i), 'summary': 'word ' * 20}
+               for i in range(10)]
+    formatted = list(pypi.format_results(results))
+    assert get_terminal_size.call_count == 1
+    assert len(formatted) == 10
+    assert 'pkg0' in formatted[0]
+    assert all(len(line) <= 60 for line in formatted[0].splitlines()[1:])
+    assert pypi.format_result(results[3]) == formatted[3]
+
+
+def test_iter_search_output_is_lazy():
+    consumed = []
+
+    def results():
+        for i in range(3):
+            consumed.append(i)
+            yield {'name': 'pkg{0}'.format(i), 'summary': None}
+    output = pypi.iter_search_output('pkg', results())
+    assert 'Search results for "pkg"' in next(output)
+    assert consumed == []
+    assert 'pkg0' in next(output)
+    assert consumed == [0]
+    assert next(output).startswith('\n')
+    assert len(list(output)) == 1
+
+
+def test_parse_upload_time():
+    assert (pypi.parse_upload_time('2014-06-05T00:39:25') ==
+            datetime(2014, 6, 5, 0, 39, 25))
+    assert (pypi.parse_upload_time('2014-06-05T00:39:25.5') ==
+            datetime(2014, 6, 5, 0, 39, 25, 500000))
+    # Falls back to dateutil for other formats
+    assert (pypi.parse_upload_time('June 5, 2014 00:39:25') ==
+            datetime(2014, 6, 5, 0, 39, 25))
+
+
+def test_import_does_not_import_heavy_dependencies():
+    code = ('import sys, pypi_cli; '
+            'print([m for m in ("requests", "dateutil", "xmlrpc.client") '
+            'if m in sys.modules])')
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.strip() == b'[]'